@@ -1,10 +1,16 @@
-from sqlalchemy import create_engine
+import logging
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.orm import sessionmaker
-from app.models import Base
+from app.models import ATTRIBUTE_INDEX_PREFIX, ATTRIBUTE_INDEXES, Base
+from dotenv import load_dotenv
 import os
 
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
 # Database configuration
-DATABASE_URL = "sqlite:///./bananashop.db"
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./bananashop.db")
 
 # Create engine
 engine = create_engine(
@@ -18,6 +24,38 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 # Create all tables
 def create_tables():
     Base.metadata.create_all(bind=engine)
+    add_missing_columns()
+    sync_attribute_indexes()
+
+def add_missing_columns():
+    """Add nullable columns declared on the models but missing from existing tables"""
+    with engine.begin() as connection:
+        inspector = inspect(connection)
+        for table in Base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or not column.nullable:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                connection.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'))
+                logger.info("Added column %s.%s", table.name, column.name)
+
+def sync_attribute_indexes():
+    """Create declared additional_data indexes missing from existing tables and drop undeclared ones"""
+    declared = {index.name for index in ATTRIBUTE_INDEXES}
+    with engine.begin() as connection:
+        existing = connection.execute(
+            text("SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE :prefix"),
+            {"prefix": f"{ATTRIBUTE_INDEX_PREFIX}%"},
+        ).scalars().all()
+        for name in existing:
+            if name not in declared:
+                connection.execute(text(f'DROP INDEX IF EXISTS "{name}"'))
+                logger.info("Dropped attribute index %s", name)
+        for index in ATTRIBUTE_INDEXES:
+            if index.name not in existing:
+                index.create(bind=connection)
+                logger.info("Created attribute index %s", index.name)
 
 # Dependency to get DB session
 def get_db():
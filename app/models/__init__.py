@@ -1,4 +1,7 @@
-from sqlalchemy import Column, Integer, String, Float, JSON, DateTime, Boolean
+import re
+from typing import Any, Dict, List
+
+from sqlalchemy import Column, Integer, String, Float, JSON, DateTime, Boolean, Index, func, literal_column
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -28,6 +31,9 @@ class Product(Base):
     price = Column(String(20), nullable=False)  # Keeping as string to match data format
     category = Column(String(100), nullable=False)
     image = Column(String(500), nullable=False)
+    image_width = Column(Integer, nullable=True)  # Pixel size of the image, so pages can reserve its space
+    image_height = Column(Integer, nullable=True)
+    image_placeholder = Column(String(1000), nullable=True)  # Tiny blurred preview as a data: URI
     description = Column(String(1000), nullable=False)
     sizes = Column(JSON, nullable=False)  # Array of sizes
     colors = Column(JSON, nullable=False)  # Array of colors
@@ -35,3 +41,82 @@ class Product(Base):
     additional_data = Column(JSON, nullable=True)  # Additional JSON column
     created_at = Column(DateTime, default=datetime.utcnow)
     is_active = Column(Boolean, default=True)
+
+class RefreshToken(Base):
+    __tablename__ = "refresh_tokens"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, index=True, nullable=False)
+    family = Column(String(32), index=True, nullable=False)  # Shared by every rotation of one login
+    token_hash = Column(String(64), unique=True, index=True, nullable=False)  # HMAC-SHA256, never the token
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False)
+    rotated_at = Column(DateTime, nullable=True)  # Exchanged for a successor
+    revoked_at = Column(DateTime, nullable=True)  # Logged out or reuse detected
+
+class ProductStats(Base):
+    __tablename__ = "product_stats"
+    
+    # Totals only grow; each worker adds its batched counts (see analytics_service)
+    product_id = Column(Integer, primary_key=True)
+    views = Column(Integer, default=0, nullable=False, index=True)
+    generations = Column(Integer, default=0, nullable=False, index=True)
+    cache_hits = Column(Integer, default=0, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class PersonalizationStats(Base):
+    __tablename__ = "personalization_stats"
+    
+    user_id = Column(Integer, primary_key=True)
+    product_id = Column(Integer, primary_key=True)
+    generations = Column(Integer, default=0, nullable=False)
+    cache_hits = Column(Integer, default=0, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class GenerationTrace(Base):
+    __tablename__ = "generation_traces"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, nullable=True)
+    product_id = Column(Integer, nullable=True)
+    status = Column(String(20), index=True, nullable=False)  # succeeded, timeout, no_image, error, ...
+    total_ms = Column(Float, nullable=True)
+    attributes = Column(JSON, nullable=True)  # Job-level details (priority, model options)
+    spans = Column(JSON, nullable=False)  # [{"name", "start_ms", "duration_ms", ...byte sizes}]
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+# additional_data keys backed by an expression index, so they can be filtered on
+# without decoding every row's JSON. Values are the type query parameters parse to.
+# Indexes are created (and ones for removed keys dropped) by create_tables().
+USER_INDEXED_ATTRIBUTES: Dict[str, type] = {}
+PRODUCT_INDEXED_ATTRIBUTES: Dict[str, type] = {"featured": bool, "season": str}
+
+ATTRIBUTE_INDEX_PREFIX = "ix_attr_"
+_ATTRIBUTE_KEY_PATTERN = re.compile(r"^[a-z_][a-z0-9_]*$")
+
+
+def additional_data_attribute(model, key: str):
+    """json_extract(additional_data, '$.key'), spelled exactly as in its index
+
+    The path is inlined rather than bound: SQLite only uses an expression index
+    when the query's expression matches the indexed one literally.
+    """
+    if not _ATTRIBUTE_KEY_PATTERN.match(key):
+        raise ValueError(f"Invalid additional_data attribute name: {key!r}")
+    return func.json_extract(model.__table__.c.additional_data, literal_column(f"'$.{key}'"))
+
+
+def attribute_conditions(model, filters: Dict[str, Any]) -> List:
+    """WHERE clauses matching each additional_data attribute to its value"""
+    return [additional_data_attribute(model, key) == value for key, value in filters.items()]
+
+
+def attribute_indexes(model, attributes: Dict[str, type]) -> List[Index]:
+    return [
+        Index(f"{ATTRIBUTE_INDEX_PREFIX}{model.__tablename__}_{key}", additional_data_attribute(model, key))
+        for key in attributes
+    ]
+
+
+# Declared on the tables, so create_all builds them along with new tables
+ATTRIBUTE_INDEXES = attribute_indexes(User, USER_INDEXED_ATTRIBUTES) + attribute_indexes(Product, PRODUCT_INDEXED_ATTRIBUTES)
@@ -0,0 +1,67 @@
+from typing import Optional
+
+from fastapi import APIRouter, BackgroundTasks, Depends, Query
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+from app.database import get_db
+from app.models import User
+from app.schemas import BulkProductResult, PriceUpdateRequest, ProductDeactivateRequest, ProductUpsertRequest
+from app.services import product_admin_service, related_service, trace_service
+from app.utils.auth import get_current_admin
+from app.utils.serialization import FastJSONResponse
+
+router = APIRouter(prefix="/api/admin/products", tags=["admin"], default_response_class=FastJSONResponse)
+traces_router = APIRouter(prefix="/api/admin/generation-traces", tags=["admin"], default_response_class=FastJSONResponse)
+
+def schedule_related_rebuild(background_tasks: BackgroundTasks, result: dict):
+    """Rebuild the related-products index after the response when product text may have changed"""
+    if result["created"] or result["updated"]:
+        background_tasks.add_task(related_service.build_related_index)
+
+@router.post("/bulk-upsert", response_model=BulkProductResult)
+async def bulk_upsert_products(
+    request: ProductUpsertRequest,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db),
+    admin: User = Depends(get_current_admin)
+):
+    """Create or update products by SKU without reloading the catalog"""
+    # The transaction, image probing and snapshot rewrite all block, so keep them off the event loop
+    result = await run_in_threadpool(product_admin_service.upsert_products, db, request.products)
+    schedule_related_rebuild(background_tasks, result)
+    return result
+
+@router.post("/bulk-price", response_model=BulkProductResult)
+async def bulk_update_prices(
+    request: PriceUpdateRequest,
+    db: Session = Depends(get_db),
+    admin: User = Depends(get_current_admin)
+):
+    """Update prices by SKU"""
+    return await run_in_threadpool(product_admin_service.update_prices, db, request.updates)
+
+@router.post("/bulk-deactivate", response_model=BulkProductResult)
+async def bulk_deactivate_products(
+    request: ProductDeactivateRequest,
+    db: Session = Depends(get_db),
+    admin: User = Depends(get_current_admin)
+):
+    """Hide products by SKU"""
+    return await run_in_threadpool(product_admin_service.deactivate_products, db, request.skus)
+
+@traces_router.get("/")
+async def list_generation_traces(
+    limit: int = Query(50, ge=1, le=500),
+    status: Optional[str] = None,
+    admin: User = Depends(get_current_admin)
+):
+    """Recent image generation jobs with their per-stage timings, newest first"""
+    return await run_in_threadpool(trace_service.recent_traces, limit, status)
+
+@traces_router.get("/summary")
+async def summarize_generation_traces(
+    window: int = Query(500, ge=1, le=trace_service.GENERATION_TRACE_RETENTION),
+    admin: User = Depends(get_current_admin)
+):
+    """Latency percentiles per generation stage over the most recent jobs"""
+    return await run_in_threadpool(trace_service.summarize_traces, window)
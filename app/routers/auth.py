@@ -2,15 +2,18 @@ from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File,
 from sqlalchemy.orm import Session
 from app.database import get_db
 from app.models import User
-from app.schemas import UserSignup, UserLogin, UserResponse, TokenResponse, PasswordStrengthResponse
-from app.utils.auth import hash_password, verify_password, create_access_token, check_password_strength
+from app.schemas import UserSignup, UserLogin, UserResponse, TokenResponse, PasswordStrengthResponse, RefreshTokenRequest
+from app.utils.auth import (
+    hash_password, verify_password, check_password_strength, create_session_tokens,
+    rotate_refresh_token, revoke_refresh_token
+)
 from app.utils.countries import COUNTRIES
-from datetime import timedelta
+from app.utils.serialization import FastJSONResponse, serialize_user
 import os
 import uuid
 from typing import Optional
 
-router = APIRouter(prefix="/api/auth", tags=["authentication"])
+router = APIRouter(prefix="/api/auth", tags=["authentication"], default_response_class=FastJSONResponse)
 
 @router.post("/signup", response_model=TokenResponse)
 async def signup(
@@ -102,26 +105,11 @@ async def signup(
     db.commit()
     db.refresh(new_user)
     
-    # Create access token for auto-login
-    access_token_expires = timedelta(minutes=30)
-    access_token = create_access_token(
-        data={"sub": new_user.email, "user_id": new_user.id},
-        expires_delta=access_token_expires
-    )
+    # Create access and refresh tokens for auto-login
+    tokens = create_session_tokens(db, new_user)
+    db.commit()
     
-    return {
-        "access_token": access_token,
-        "token_type": "bearer",
-        "user": {
-            "id": new_user.id,
-            "name": new_user.name,
-            "email": new_user.email,
-            "country": new_user.country,
-            "gender": new_user.gender,
-            "image": new_user.image,
-            "created_at": new_user.created_at
-        }
-    }
+    return FastJSONResponse({**tokens, "user": serialize_user(new_user)})
 
 @router.post("/login", response_model=TokenResponse)
 async def login(user_credentials: UserLogin, db: Session = Depends(get_db)):
@@ -142,26 +130,23 @@ async def login(user_credentials: UserLogin, db: Session = Depends(get_db)):
             detail="Invalid email or password"
         )
     
-    # Create access token
-    access_token_expires = timedelta(minutes=30)
-    access_token = create_access_token(
-        data={"sub": user.email, "user_id": user.id},
-        expires_delta=access_token_expires
-    )
+    # Create access and refresh tokens; the client refreshes instead of logging in again
+    tokens = create_session_tokens(db, user)
+    db.commit()
     
-    return {
-        "access_token": access_token,
-        "token_type": "bearer",
-        "user": {
-            "id": user.id,
-            "name": user.name,
-            "email": user.email,
-            "country": user.country,
-            "gender": user.gender,
-            "image": user.image,
-            "created_at": user.created_at
-        }
-    }
+    return FastJSONResponse({**tokens, "user": serialize_user(user)})
+
+@router.post("/refresh", response_model=TokenResponse)
+async def refresh(request: RefreshTokenRequest, db: Session = Depends(get_db)):
+    """Exchange a refresh token for a new access token and a rotated refresh token"""
+    user, tokens = rotate_refresh_token(db, request.refresh_token)
+    return FastJSONResponse({**tokens, "user": serialize_user(user)})
+
+@router.post("/logout")
+async def logout(request: RefreshTokenRequest, db: Session = Depends(get_db)):
+    """Revoke the session's refresh tokens"""
+    revoke_refresh_token(db, request.refresh_token)
+    return {"message": "Logged out"}
 
 @router.post("/check-password", response_model=PasswordStrengthResponse)
 async def check_password_endpoint(password: str = Form(...)):
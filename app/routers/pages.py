@@ -0,0 +1,45 @@
+from fastapi import APIRouter, Request
+from app.services.analytics_service import analytics
+from app.services.catalog_service import catalog_cache
+from app.utils.static_assets import template_pages
+
+router = APIRouter()
+
+# Serve the main HTML file
+@router.get("/")
+async def read_index(request: Request):
+    return template_pages.response(request, 'index.html')
+
+@router.get("/login")
+async def read_login(request: Request):
+    return template_pages.response(request, 'login.html')
+
+@router.get("/signup")
+async def read_signup(request: Request):
+    return template_pages.response(request, 'signup.html')
+
+@router.get("/men")
+async def read_men(request: Request):
+    # Inline the listing so the first view needs no follow-up API call
+    page = template_pages.render(
+        'men.html', None, catalog_cache.page_version("men"), catalog_cache.updated_at,
+        lambda: {"products": catalog_cache.get_products("men")}
+    )
+    return template_pages.page_response(request, page)
+
+@router.get("/women")
+async def read_women(request: Request):
+    return template_pages.response(request, 'women.html')
+
+@router.get("/product/{product_id}")
+async def read_product(request: Request, product_id: int):
+    product = catalog_cache.get_product(product_id)
+    if product is None:
+        # Unknown product: serve the plain shell and let the page show its not-found state
+        return template_pages.response(request, 'product.html')
+    analytics.record_view(product_id)
+    page = template_pages.render(
+        'product.html', product_id, catalog_cache.page_version(product_id), catalog_cache.updated_at,
+        lambda: {"product": product}
+    )
+    return template_pages.page_response(request, page)
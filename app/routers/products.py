@@ -1,48 +1,134 @@
-from fastapi import APIRouter, Depends, HTTPException, Query, Body, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, Query, Body, Request, Response
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 from app.database import get_db
-from app.models import Product, User
+from app.models import PRODUCT_INDEXED_ATTRIBUTES, Product, User, attribute_conditions
 from app.schemas import ProductResponse
 from app.utils.auth import get_current_user_optional
+from app.utils.cache import cache
+from app.services.analytics_service import POPULARITY_METRICS, analytics, popular_product_ids
+from app.services.catalog_service import catalog_cache, select_products
+from app.services.related_service import related_index
+from app.utils.serialization import FastJSONResponse, PRODUCT_FIELDS, product_rows_to_dicts, serialize_product
 from typing import List, Optional, Dict, Any
+import logging
 
-router = APIRouter(prefix="/api/products", tags=["products"])
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/api/products", tags=["products"], default_response_class=FastJSONResponse)
+
+PRODUCT_CACHE_TTL = 300  # Seconds a product lookup stays in the shared cache
+
+_BOOLEAN_VALUES = {"true": True, "1": True, "yes": True, "false": False, "0": False, "no": False}
+
+def attribute_filters(request: Request) -> Dict[str, Any]:
+    """Indexed additional_data attributes given as query parameters (e.g. ?featured=true&season=summer)"""
+    filters = {}
+    for key, kind in PRODUCT_INDEXED_ATTRIBUTES.items():
+        value = request.query_params.get(key)
+        if value is None:
+            continue
+        if kind is bool:
+            if value.lower() not in _BOOLEAN_VALUES:
+                raise HTTPException(status_code=422, detail=f"{key} must be true or false")
+            filters[key] = _BOOLEAN_VALUES[value.lower()]
+            continue
+        try:
+            filters[key] = kind(value)
+        except ValueError:
+            raise HTTPException(status_code=422, detail=f"{key} must be a {kind.__name__}")
+    return filters
+
+def _lookup_product(db: Session, key: str, condition) -> Optional[dict]:
+    """Cached product record (response fields plus is_active) matching `condition`, active or not"""
+    record = cache.get(key)
+    if record is None:
+        rows = product_rows_to_dicts(
+            db.execute(select_products(Product.is_active, active_only=False).where(condition).limit(1)),
+            PRODUCT_FIELDS + ("is_active",),
+        )
+        if not rows:
+            return None
+        record = rows[0]
+        cache.set(key, record, ttl=PRODUCT_CACHE_TTL)
+    return record
+
+def get_cached_product(db: Session, product_id: int) -> Optional[dict]:
+    """Look up a product by ID through the loaded catalog, then the shared cache, active or not"""
+    product = catalog_cache.peek_product(product_id)
+    if product is not None:
+        return {**product, "is_active": True}
+    return _lookup_product(db, f"product:{product_id}", Product.id == product_id)
+
+def get_cached_product_by_sku(db: Session, sku: str) -> Optional[dict]:
+    """Look up a product by SKU through the loaded catalog, then the shared cache, active or not"""
+    product = catalog_cache.peek_product_by_sku(sku)
+    if product is not None:
+        return {**product, "is_active": True}
+    return _lookup_product(db, f"product:sku:{sku}", Product.sku == sku)
 
 @router.get("/", response_model=List[ProductResponse])
 async def get_products(
     gender: Optional[str] = Query(None, description="Filter by gender (men/women)"),
     category: Optional[str] = Query(None, description="Filter by category"),
+    size: Optional[List[str]] = Query(None, description="Filter by size (repeat for any of several)"),
+    color: Optional[List[str]] = Query(None, description="Filter by color (repeat for any of several)"),
+    attributes: Dict[str, Any] = Depends(attribute_filters),
     db: Session = Depends(get_db)
 ):
-    """Get all products with optional filters"""
-    query = db.query(Product).filter(Product.is_active == True)
-    
-    if gender:
-        query = query.filter(Product.gender == gender.lower())
-    
-    if category:
-        query = query.filter(Product.category.ilike(f"%{category}%"))
+    """Get all products with optional filters, including indexed additional_data attributes"""
+    if attributes:
+        # The attributes' expression indexes find the matching IDs without decoding any JSON;
+        # the catalog's inverted index applies the remaining filters
+        query = select(Product.id).where(Product.is_active == True, *attribute_conditions(Product, attributes))
+        matching = set(db.scalars(query))
+        products = catalog_cache.filter_products(gender, category, size, color) if matching else []
+        return FastJSONResponse([product for product in products if product["id"] in matching])
+
+    if size or color:
+        # Sizes and colors are JSON columns; the catalog's inverted index answers these without a scan
+        return FastJSONResponse(catalog_cache.filter_products(gender, category, size, color))
     
-    products = query.all()
-    return products
+    # Served from the catalog snapshot's pre-encoded products
+    return Response(catalog_cache.get_products_json(gender, category), media_type="application/json")
 
 @router.get("/men", response_model=List[ProductResponse])
-async def get_men_products(db: Session = Depends(get_db)):
+async def get_men_products():
     """Get all men's products"""
-    products = db.query(Product).filter(
-        Product.gender == "men",
-        Product.is_active == True
-    ).all()
-    return products
+    return Response(catalog_cache.get_products_json("men"), media_type="application/json")
 
 @router.get("/women", response_model=List[ProductResponse])
-async def get_women_products(db: Session = Depends(get_db)):
+async def get_women_products():
     """Get all women's products"""
-    products = db.query(Product).filter(
-        Product.gender == "women",
-        Product.is_active == True
-    ).all()
-    return products
+    return Response(catalog_cache.get_products_json("women"), media_type="application/json")
+
+@router.get("/facets")
+async def get_product_facets(
+    gender: Optional[str] = Query(None, description="Filter by gender (men/women)"),
+    category: Optional[str] = Query(None, description="Filter by category"),
+    size: Optional[List[str]] = Query(None, description="Filter by size (repeat for any of several)"),
+    color: Optional[List[str]] = Query(None, description="Filter by color (repeat for any of several)")
+):
+    """Count matching products per size, color and category for the given filters"""
+    return FastJSONResponse(catalog_cache.facet_counts(gender, category, size, color))
+
+@router.get("/popular", response_model=List[ProductResponse])
+async def get_popular_products(
+    by: str = Query("views", description=f"Ranking metric: {', '.join(POPULARITY_METRICS)}"),
+    gender: Optional[str] = Query(None, description="Filter by gender (men/women)"),
+    limit: int = Query(20, ge=1, le=100, description="Maximum number of products")
+):
+    """Get the most viewed or most personalized products, most popular first"""
+    if by not in POPULARITY_METRICS:
+        raise HTTPException(status_code=422, detail=f"by must be one of: {', '.join(POPULARITY_METRICS)}")
+    
+    # Counts are flushed every few seconds; products deactivated since then are skipped
+    products = []
+    for product_id in popular_product_ids(by, gender, limit):
+        product = catalog_cache.get_product(product_id)
+        if product is not None:
+            products.append(product)
+    return FastJSONResponse(products)
 
 ###############
 
@@ -55,7 +141,7 @@ async def get_personalized_image(
     """Check if a personalized image exists for the current user and product"""
     
     # Verify product exists
-    product = db.query(Product).filter(Product.id == product_id).first()
+    product = get_cached_product(db, product_id)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     
@@ -65,7 +151,7 @@ async def get_personalized_image(
             "has_personalized_image": False,
             "personalized_image_url": None,
             "is_generating": False,
-            "original_image_url": product.image,
+            "original_image_url": product["image"],
             "authentication_required": True
         }
     
@@ -75,7 +161,7 @@ async def get_personalized_image(
             "has_personalized_image": False,
             "personalized_image_url": None,
             "is_generating": False,
-            "original_image_url": product.image,
+            "original_image_url": product["image"],
             "profile_image_required": True
         }
     
@@ -89,21 +175,38 @@ async def get_personalized_image(
                 "has_personalized_image": True,
                 "personalized_image_url": cached_url,
                 "is_generating": False,
-                "original_image_url": product.image,
+                "original_image_url": product["image"],
                 "ready_for_personalization": True
             }
-    except Exception as e:
-        print(f"Cache check error: {e}")
+    except Exception:
+        logger.exception("Cache check error")
     
     # No cached image found
     return {
         "has_personalized_image": False,
         "personalized_image_url": None,
         "is_generating": False,
-        "original_image_url": product.image,
+        "original_image_url": product["image"],
         "ready_for_personalization": True
     }
 
+@router.get("/{product_id}/related", response_model=List[ProductResponse])
+async def get_related_products(
+    product_id: int,
+    limit: int = Query(8, ge=1, le=50, description="Maximum number of related products")
+):
+    """Get products similar to this one, most similar first"""
+    if catalog_cache.get_product(product_id) is None:
+        raise HTTPException(status_code=404, detail="Product not found")
+    
+    # Precomputed neighbours; skip any deactivated since the index was built
+    related = []
+    for related_id, _ in related_index.lookup(product_id, limit):
+        product = catalog_cache.get_product(related_id)
+        if product is not None:
+            related.append(product)
+    return FastJSONResponse(related)
+
 @router.get("/{product_id}", response_model=ProductResponse)
 async def get_product(
     product_id: int, 
@@ -112,33 +215,28 @@ async def get_product(
 ):
     """Get a specific product by ID"""
     
-    product = db.query(Product).filter(
-        Product.id == product_id,
-        Product.is_active == True
-    ).first()
+    product = get_cached_product(db, product_id)
     
-    if not product:
+    if not product or not product["is_active"]:
         raise HTTPException(status_code=404, detail="Product not found")
 
-    return product
+    analytics.record_view(product_id)
+    return FastJSONResponse(serialize_product(product))
 
 @router.get("/sku/{sku}", response_model=ProductResponse)
 async def get_product_by_sku(sku: str, db: Session = Depends(get_db)):
     """Get a specific product by SKU"""
-    product = db.query(Product).filter(
-        Product.sku == sku,
-        Product.is_active == True
-    ).first()
+    product = get_cached_product_by_sku(db, sku)
     
-    if not product:
+    if not product or not product["is_active"]:
         raise HTTPException(status_code=404, detail="Product not found")
     
-    return product
+    return FastJSONResponse(serialize_product(product))
 
 @router.post("/{product_id}/generate-personalized-image")
 async def generate_personalized_image(
     product_id: int,
-    background_tasks: BackgroundTasks,
+    priority: str = Query("browse", description="view (product page) or browse (listing card)"),
     db: Session = Depends(get_db),
     current_user: Optional[User] = Depends(get_current_user_optional)
 ):
@@ -171,29 +269,47 @@ async def generate_personalized_image(
         cached_url = image_cache.get_cached_image_url(current_user.id, product_id)
         
         if cached_url:
+            analytics.record_cache_hit(current_user.id, product_id)
             return {
                 "status": "already_exists",
                 "personalized_image_url": cached_url,
                 "message": "Personalized image already exists"
             }
-    except Exception as e:
-        print(f"Cache check error: {e}")
+    except Exception:
+        logger.exception("Cache check error")
     
-    # Trigger background generation
+    # Trigger background generation, unless the queue is too deep for this request's priority
     try:
-        from app.utils.background_tasks import trigger_image_generation
+        from app.utils.admission import PRIORITIES, PRIORITY_BROWSE, admission
+        from app.utils.background_tasks import image_task_manager, trigger_image_generation
+        
+        request_priority = PRIORITIES.get(priority, PRIORITY_BROWSE)
+        reserved = False
+        if not image_task_manager.is_generating(current_user.id, product_id):
+            retry_after = admission.admit(request_priority)
+            if retry_after is not None:
+                return {
+                    "status": "deferred",
+                    "retry_after": retry_after,
+                    "message": "Personalization is busy; try again shortly"
+                }
+            # Counted in the queue depth until the job queues for a slot
+            reserved = True
         
-        print(f"Attempting to generate personalized image for user {current_user.id}, product {product_id}")
-        print(f"User image path: {current_user.image}")
-        print(f"Product image path: {product.image}")
+        log_extra = {"user_id": current_user.id, "product_id": product_id}
+        logger.debug(
+            "Attempting to generate personalized image (user image: %s, product image: %s)",
+            current_user.image, product.image, extra=log_extra
+        )
         
         result = trigger_image_generation(
-            background_tasks=background_tasks,
             user=current_user,
-            product=product
+            product=product,
+            priority=request_priority,
+            reserved=reserved
         )
         
-        print(f"Generation trigger result: {result}")
+        logger.debug("Generation trigger result: %s", result, extra=log_extra)
         
         return {
             "status": "generation_started",
@@ -202,9 +318,7 @@ async def generate_personalized_image(
         }
         
     except Exception as e:
-        print(f"Generation trigger error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Generation trigger error")
         raise HTTPException(status_code=500, detail=f"Failed to start image generation: {str(e)}")
 
 
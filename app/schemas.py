@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr, validator
-from typing import Optional, List
+from typing import Any, Dict, Optional, List
 from datetime import datetime
 
 class UserSignup(BaseModel):
@@ -49,15 +49,63 @@ class ProductResponse(BaseModel):
     sizes: List[str]
     colors: List[str]
     gender: str
+    image_width: Optional[int] = None
+    image_height: Optional[int] = None
+    image_placeholder: Optional[str] = None
     
     class Config:
         from_attributes = True
 
+class ProductUpsert(BaseModel):
+    sku: str
+    name: str
+    price: str
+    category: str
+    image: str
+    description: str
+    sizes: List[str]
+    colors: List[str]
+    gender: str
+    is_active: bool = True
+    additional_data: Optional[Dict[str, Any]] = None  # Merchandising flags, e.g. {"featured": true}
+    
+    @validator('gender')
+    def validate_gender(cls, v):
+        if v.lower() not in ['men', 'women']:
+            raise ValueError('Gender must be either men or women')
+        return v.lower()
+
+class ProductUpsertRequest(BaseModel):
+    products: List[ProductUpsert]
+
+class PriceUpdate(BaseModel):
+    sku: str
+    price: str
+
+class PriceUpdateRequest(BaseModel):
+    updates: List[PriceUpdate]
+
+class ProductDeactivateRequest(BaseModel):
+    skus: List[str]
+
+class BulkProductResult(BaseModel):
+    created: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    deactivated: int = 0
+    images_changed: int = 0
+    not_found: List[str] = []
+
 class TokenResponse(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
+    expires_in: Optional[int] = None  # Access token lifetime in seconds
     user: Optional[UserResponse] = None
 
+class RefreshTokenRequest(BaseModel):
+    refresh_token: str
+
 class PasswordStrengthResponse(BaseModel):
     score: int
     strength: str
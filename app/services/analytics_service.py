@@ -0,0 +1,166 @@
+import logging
+import os
+import threading
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert
+
+from app.database import engine
+from app.models import PersonalizationStats, Product, ProductStats
+from app.utils.cache import cache
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Configuration
+ANALYTICS_FLUSH_INTERVAL = float(os.getenv("ANALYTICS_FLUSH_INTERVAL", "10"))  # Seconds between writes, 0 = only on shutdown
+POPULAR_CACHE_TTL = 60  # Seconds a popularity ranking stays in the shared cache
+# Rows per INSERT: a statement binds one parameter per column per row, and SQLite caps the
+# parameters per statement (32766), so a large flush is written in chunks
+FLUSH_CHUNK_ROWS = 1000
+
+# Metrics a popularity listing can be ordered by
+POPULARITY_METRICS = ("views", "generations")
+
+
+def _upsert(table, key_columns: Tuple[str, ...], rows: List[dict]):
+    """INSERT the rows, adding their counts to any existing totals"""
+    statement = insert(table).values(rows)
+    counts = [name for name in rows[0] if name not in key_columns and name != "updated_at"]
+    statement = statement.on_conflict_do_update(
+        index_elements=list(key_columns),
+        set_={
+            **{name: getattr(table.c, name) + getattr(statement.excluded, name) for name in counts},
+            "updated_at": statement.excluded.updated_at,
+        },
+    )
+    return statement
+
+
+class AnalyticsCounters:
+    """Per-process counters bumped on the request path and written to SQLite in batches
+
+    Recording is a dict increment under a lock; no request waits on the database.
+    Counts not yet flushed are lost if the process is killed, which is the trade-off
+    for write-behind.
+    """
+
+    def __init__(self, flush_interval: float = ANALYTICS_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self._views: Counter = Counter()
+        self._generations: Counter = Counter()  # (user_id, product_id) -> count
+        self._cache_hits: Counter = Counter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def record_view(self, product_id: int):
+        with self._lock:
+            self._views[product_id] += 1
+
+    def record_generation(self, user_id: int, product_id: int):
+        with self._lock:
+            self._generations[user_id, product_id] += 1
+
+    def record_cache_hit(self, user_id: int, product_id: int):
+        with self._lock:
+            self._cache_hits[user_id, product_id] += 1
+
+    def _take(self) -> Tuple[Counter, Counter, Counter]:
+        with self._lock:
+            taken = self._views, self._generations, self._cache_hits
+            self._views, self._generations, self._cache_hits = Counter(), Counter(), Counter()
+        return taken
+
+    def _restore(self, views: Counter, generations: Counter, cache_hits: Counter):
+        # A failed flush puts its counts back for the next attempt
+        with self._lock:
+            self._views.update(views)
+            self._generations.update(generations)
+            self._cache_hits.update(cache_hits)
+
+    def flush(self) -> int:
+        """Add the pending counts to the stats tables in one transaction; returns rows written"""
+        views, generations, cache_hits = self._take()
+        if not (views or generations or cache_hits):
+            return 0
+
+        now = datetime.utcnow()
+        product_rows: Dict[int, dict] = {}
+        pair_rows: Dict[Tuple[int, int], dict] = {}
+        for product_id, count in views.items():
+            product_rows.setdefault(product_id, {"product_id": product_id, "views": 0, "generations": 0, "cache_hits": 0})
+            product_rows[product_id]["views"] += count
+        for counter, field in ((generations, "generations"), (cache_hits, "cache_hits")):
+            for (user_id, product_id), count in counter.items():
+                product_rows.setdefault(product_id, {"product_id": product_id, "views": 0, "generations": 0, "cache_hits": 0})
+                product_rows[product_id][field] += count
+                pair_rows.setdefault((user_id, product_id), {
+                    "user_id": user_id, "product_id": product_id, "generations": 0, "cache_hits": 0
+                })
+                pair_rows[user_id, product_id][field] += count
+
+        try:
+            with engine.begin() as connection:
+                for table, key_columns, pending in (
+                    (ProductStats.__table__, ("product_id",), product_rows),
+                    (PersonalizationStats.__table__, ("user_id", "product_id"), pair_rows),
+                ):
+                    rows = [{**row, "updated_at": now} for row in pending.values()]
+                    for start in range(0, len(rows), FLUSH_CHUNK_ROWS):
+                        connection.execute(_upsert(table, key_columns, rows[start:start + FLUSH_CHUNK_ROWS]))
+        except Exception:
+            self._restore(views, generations, cache_hits)
+            logger.exception("Analytics flush failed")
+            return 0
+        return len(product_rows) + len(pair_rows)
+
+    def start(self):
+        """Start the background flush thread"""
+        if self.flush_interval <= 0 or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="analytics-flush", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the flush thread and write whatever is still pending"""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+
+def popular_product_ids(metric: str = "views", gender: Optional[str] = None, limit: int = 20) -> List[int]:
+    """IDs of active products ordered by a flushed metric, highest first (cached briefly)"""
+    key = f"popular:{metric}:{gender or 'all'}:{limit}"
+    ids = cache.get(key)
+    if ids is None:
+        column = getattr(ProductStats, metric)
+        query = (
+            select(ProductStats.product_id)
+            .join(Product, Product.id == ProductStats.product_id)
+            .where(Product.is_active == True, column > 0)
+            .order_by(column.desc(), ProductStats.product_id)
+            .limit(limit)
+        )
+        if gender:
+            query = query.where(Product.gender == gender.lower())
+        with engine.connect() as connection:
+            ids = list(connection.scalars(query))
+        cache.set(key, ids, ttl=POPULAR_CACHE_TTL)
+    return ids
+
+
+# Global analytics counters instance
+analytics = AnalyticsCounters()
@@ -0,0 +1,564 @@
+import array
+import bisect
+import fcntl
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Set
+
+from sqlalchemy import select
+
+from app.database import SessionLocal
+from app.models import Product
+from app.utils.cache import EXACT_MARKER, cache
+from app.utils.serialization import PRODUCT_FIELDS, dumps, product_rows_to_dicts
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+CATALOG_SNAPSHOT_PATH = os.getenv("CATALOG_SNAPSHOT_PATH", "catalog_snapshot.bin")  # Empty disables snapshots
+
+# Snapshot layout (little-endian): header, ids[n] (sorted), offsets[n+1] into the
+# concatenated per-product JSON, the JSON itself, then a JSON object of indexes
+_SNAPSHOT_MAGIC = b"CATS"
+_SNAPSHOT_FORMAT = 3
+_SNAPSHOT_HEADER = struct.Struct("<4sH12sdII")  # magic, format, version, updated_at, count, index offset
+
+# Only the columns a product response needs, in PRODUCT_FIELDS order
+PRODUCT_COLUMNS = tuple(getattr(Product, field) for field in PRODUCT_FIELDS)
+
+# A changed product whose values for these stay the same keeps its place in the indexes
+INDEXED_FIELDS = ("sku", "gender", "category", "sizes", "colors")
+
+PATCH_BATCH_SIZE = 500  # Product IDs per re-read query when patching changed products
+
+
+def select_products(*extra_columns, active_only: bool = True):
+    """Core select over the response columns (plus `extra_columns`), skipping ORM instances"""
+    query = select(*PRODUCT_COLUMNS, *extra_columns)
+    if active_only:
+        query = query.where(Product.is_active == True)
+    return query
+
+
+# Positions of the set bits in every byte value, for walking bitmaps a byte at a time
+_BYTE_BITS = [tuple(bit for bit in range(8) if value >> bit & 1) for value in range(256)]
+
+
+def _matching_categories(categories: Iterable[str], category: str) -> List[str]:
+    """Normalized categories containing `category`, case-insensitively (like ILIKE %x%)"""
+    needle = category.lower()
+    return [key for key in categories if needle in key]
+
+
+def _bitmap(positions: Iterable[int], size: int) -> int:
+    """Build an int bitmap with the given bit positions set"""
+    buffer = bytearray((size + 7) // 8)
+    for position in positions:
+        buffer[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(buffer, "little")
+
+
+class FacetIndex:
+    """Bitmap inverted index over a catalog snapshot: one int bitmap per attribute value
+
+    Bit i stands for the i-th product of the snapshot, so filters are ANDs/ORs of
+    bitmaps and facet counts are popcounts.
+    """
+
+    ATTRIBUTES = ("gender", "category", "size", "color")
+
+    def __init__(self, products: List[dict]):
+        self.products = products
+        self.all = (1 << len(products)) - 1
+        positions: Dict[str, Dict[str, List[int]]] = {attribute: {} for attribute in self.ATTRIBUTES}
+        # Display label for each normalized value (first spelling seen)
+        self.labels: Dict[str, Dict[str, str]] = {attribute: {} for attribute in self.ATTRIBUTES}
+
+        for position, product in enumerate(products):
+            values = {
+                "gender": [product["gender"]],
+                "category": [product["category"]],
+                "size": product["sizes"],
+                "color": product["colors"],
+            }
+            for attribute, attribute_values in values.items():
+                for value in attribute_values:
+                    key = value.lower()
+                    positions[attribute].setdefault(key, []).append(position)
+                    self.labels[attribute].setdefault(key, value)
+
+        self.bitmaps: Dict[str, Dict[str, int]] = {
+            attribute: {key: _bitmap(found, len(products)) for key, found in values.items()}
+            for attribute, values in positions.items()
+        }
+
+    def match(self, attribute: str, values: Optional[Iterable[str]]) -> int:
+        """Products having any of `values` for `attribute` (all products if no values given)"""
+        if not values:
+            return self.all
+        bitmaps = self.bitmaps[attribute]
+        mask = 0
+        for value in values:
+            mask |= bitmaps.get(value.lower(), 0)
+        return mask
+
+    def match_category(self, category: Optional[str]) -> int:
+        """Products whose category contains `category`, case-insensitively (like ILIKE %x%)"""
+        if not category:
+            return self.all
+        bitmaps = self.bitmaps["category"]
+        mask = 0
+        for key in _matching_categories(bitmaps, category):
+            mask |= bitmaps[key]
+        return mask
+
+    def filter_mask(self, gender=None, category=None, sizes=None, colors=None, skip: Optional[str] = None) -> int:
+        """AND of every filter, leaving out the `skip` attribute (used for its own facet counts)"""
+        mask = self.match("gender", [gender] if gender else None) & self.match_category(category)
+        if skip != "size":
+            mask &= self.match("size", sizes)
+        if skip != "color":
+            mask &= self.match("color", colors)
+        return mask
+
+    def select(self, mask: int) -> List[dict]:
+        """Products whose bits are set in `mask`, in snapshot order"""
+        products = self.products
+        selected = []
+        for index, byte in enumerate(mask.to_bytes((len(products) + 7) // 8, "little")):
+            if byte:
+                base = index << 3
+                selected.extend(products[base + bit] for bit in _BYTE_BITS[byte])
+        return selected
+
+    def counts(self, attribute: str, mask: int) -> Dict[str, int]:
+        """Matching products per value of `attribute` within `mask`, most common first"""
+        counts = {
+            self.labels[attribute][key]: count
+            for key, bitmap in self.bitmaps[attribute].items()
+            if (count := (bitmap & mask).bit_count())
+        }
+        return dict(sorted(counts.items(), key=lambda item: -item[1]))
+
+
+class CatalogSnapshot:
+    """Read-only, memory-mapped catalog snapshot written by write_snapshot()
+
+    Each product is stored as its pre-serialized JSON, so responses can be
+    assembled from the mapped bytes without decoding; the pages are shared
+    by every worker through the OS page cache.
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, format_version, version, self.updated_at, count, index_offset = _SNAPSHOT_HEADER.unpack_from(self._map)
+        if magic != _SNAPSHOT_MAGIC or format_version != _SNAPSHOT_FORMAT:
+            self._map.close()
+            raise ValueError(f"Not a catalog snapshot: {path}")
+        self.version = version.decode("ascii")
+
+        view = memoryview(self._map)
+        offset = _SNAPSHOT_HEADER.size
+        self.ids = view[offset:offset + count * 4].cast("i")
+        offset += count * 4
+        self._offsets = view[offset:offset + (count + 1) * 4].cast("I")
+        self._blob_start = offset + (count + 1) * 4
+        self.indexes = json.loads(bytes(view[index_offset:]))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def position(self, product_id: int) -> Optional[int]:
+        """Position of a product in the snapshot (ordered by ID), or None"""
+        position = bisect.bisect_left(self.ids, product_id)
+        if position < len(self.ids) and self.ids[position] == product_id:
+            return position
+        return None
+
+    def sku_position(self, sku: str) -> Optional[int]:
+        return self.indexes["sku"].get(sku)
+
+    def positions(self, gender: Optional[str] = None, category: Optional[str] = None) -> Iterable[int]:
+        """Positions of the products in a gender and/or category listing, in snapshot order
+
+        `category` matches as a substring, as in FacetIndex.match_category.
+        """
+        if gender:
+            found = self.indexes["gender"].get(gender.lower(), [])
+        else:
+            found = range(len(self))
+        if category:
+            by_category = self.indexes["category"]
+            in_category = set()
+            for key in _matching_categories(by_category, category):
+                in_category.update(by_category[key])
+            found = [position for position in found if position in in_category]
+        return found
+
+    def product_json(self, position: int) -> bytes:
+        start = self._blob_start + self._offsets[position]
+        return self._map[start:self._blob_start + self._offsets[position + 1]]
+
+    def product(self, position: int) -> dict:
+        return json.loads(self.product_json(position))
+
+    def products(self) -> List[dict]:
+        return [self.product(position) for position in range(len(self))]
+
+    def products_json(self, positions: Iterable[int]) -> bytes:
+        """JSON array of the given products, spliced from their stored encodings"""
+        return b"[" + b",".join(self.product_json(position) for position in positions) + b"]"
+
+
+def catalog_version(products: List[dict]) -> str:
+    """Digest identifying the catalog content"""
+    return hashlib.sha1(json.dumps(products, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+
+
+def snapshot_version(path: str = CATALOG_SNAPSHOT_PATH) -> Optional[str]:
+    """Version recorded in an existing snapshot file, read from its header only"""
+    try:
+        with open(path, "rb") as file:
+            header = file.read(_SNAPSHOT_HEADER.size)
+        magic, format_version, version = _SNAPSHOT_HEADER.unpack(header)[:3]
+    except (OSError, struct.error):
+        return None
+    if magic != _SNAPSHOT_MAGIC or format_version != _SNAPSHOT_FORMAT:
+        return None
+    return version.decode("ascii")
+
+
+def write_snapshot(products: List[dict], version: str, updated_at: float, path: str = CATALOG_SNAPSHOT_PATH):
+    """Write a catalog snapshot atomically (temp file + rename)"""
+    products = sorted(products, key=lambda product: product["id"])
+    encoded = [dumps(product) for product in products]
+    offsets = array.array("I", [0])
+    for item in encoded:
+        offsets.append(offsets[-1] + len(item))
+
+    # Lookups served straight from the mapped file: by SKU, and the per-gender and per-category listings
+    indexes = {"sku": {}, "gender": {}, "category": {}}
+    for position, product in enumerate(products):
+        indexes["sku"][product["sku"]] = position
+        indexes["gender"].setdefault(product["gender"], []).append(position)
+        indexes["category"].setdefault(product["category"].lower(), []).append(position)
+
+    ids = array.array("i", [product["id"] for product in products])
+    index_offset = _SNAPSHOT_HEADER.size + len(ids) * 4 + len(offsets) * 4 + offsets[-1]
+    header = _SNAPSHOT_HEADER.pack(
+        _SNAPSHOT_MAGIC, _SNAPSHOT_FORMAT, version.encode("ascii"), updated_at, len(products), index_offset
+    )
+
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as file:
+        file.write(header)
+        file.write(ids.tobytes())
+        file.write(offsets.tobytes())
+        for item in encoded:
+            file.write(item)
+        file.write(dumps(indexes))
+    os.replace(temp_path, path)
+
+
+def write_catalog_snapshot(path: str = CATALOG_SNAPSHOT_PATH) -> int:
+    """Snapshot the active catalog from the database (run after loading or changing products)"""
+    # Serialize writers across processes, so a slower writer's older read can't land last
+    with open(f"{path}.lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        db = SessionLocal()
+        try:
+            products = product_rows_to_dicts(db.execute(select_products().order_by(Product.id)))
+        finally:
+            db.close()
+        write_snapshot(products, catalog_version(products), time.time(), path)
+    return len(products)
+
+
+class CatalogCache:
+    """In-process snapshot of the active catalog, versioned by a digest of its content
+
+    A worker can start from the mapped snapshot file (load_snapshot) and only
+    decodes products when a request needs them as dicts. The catalog is kept
+    until a change is broadcast through the shared cache; there is no periodic
+    re-read. Changes to individual products are patched in: only those rows are
+    re-read, and only the listings and pages that show them are rebuilt.
+    """
+
+    def __init__(self, snapshot_path: str = CATALOG_SNAPSHOT_PATH):
+        self.snapshot_path = snapshot_path
+        self.version: Optional[str] = None
+        self.updated_at = 0.0  # Wall-clock time the current version was first seen
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self._products: Optional[List[dict]] = None
+        self._by_id: Dict[int, dict] = {}
+        self._by_sku: Dict[str, dict] = {}
+        self._facets: Optional[FacetIndex] = None
+        self._json: Dict[Optional[str], bytes] = {}  # Encoded listings of the current version, by gender
+        self._pending: Set[int] = set()  # Products changed by some worker, patched in on next use
+        self._revision = 0  # Patches applied since the current version was loaded
+        self._revisions: Dict[object, int] = {}  # Gender or product ID -> revision that last changed it
+        self._lock = threading.Lock()
+        # A whole-catalog change drops everything; a product change patches just that product
+        cache.subscribe("catalog", self._drop)
+        cache.subscribe("product:", self._on_product_event)
+
+    def _drop(self, prefix: str = ""):
+        self._products = None
+        self._snapshot = None
+
+    def _on_product_event(self, prefix: str):
+        if not prefix.startswith(EXACT_MARKER):
+            # A prefix invalidation (e.g. after load_products.py) may cover every product
+            self._drop()
+            return
+        product_id = prefix[len(EXACT_MARKER) + len("product:"):]
+        # product:sku:<sku> events name the same products again
+        if product_id.isdigit():
+            self._pending.add(int(product_id))
+
+    def _set_version(self, version: str, updated_at: float):
+        if version != self.version:
+            self._json = {}
+            self._revision = 0
+            self._revisions = {}
+        self.version, self.updated_at = version, updated_at
+
+    def _use(self, products: List[dict]):
+        """Swap in decoded products and the indexes built from them"""
+        self._by_id = {product["id"]: product for product in products}
+        self._by_sku = {product["sku"]: product for product in products}
+        self._facets = FacetIndex(products)
+        self._products = products
+
+    def _load(self):
+        """Read all active products and swap them in, bumping the version only if content changed"""
+        db = SessionLocal()
+        try:
+            products = product_rows_to_dicts(db.execute(select_products().order_by(Product.id)))
+        finally:
+            db.close()
+
+        version = catalog_version(products)
+        if version != self.version:
+            self._set_version(version, time.time())
+        self._pending = set()
+
+        snapshot = None
+        if self.snapshot_path:
+            try:
+                # Keep the file current so workers started after a catalog change begin warm
+                if snapshot_version(self.snapshot_path) != version:
+                    write_snapshot(products, version, self.updated_at, self.snapshot_path)
+                snapshot = CatalogSnapshot(self.snapshot_path)
+            except (OSError, ValueError, struct.error):
+                logger.exception("Could not write or map catalog snapshot")
+
+        if snapshot is not None and snapshot.version == version:
+            # Serve from the mapped file, whose pages every worker shares, not a private copy
+            self._snapshot = snapshot
+            self._products = None
+        else:
+            self._snapshot = None
+            self._use(products)
+
+    def load_snapshot(self) -> bool:
+        """Start from the snapshot file instead of the database; False if there is none"""
+        try:
+            snapshot = CatalogSnapshot(self.snapshot_path)
+        except (OSError, ValueError, struct.error):
+            logger.info("No usable catalog snapshot at %s", self.snapshot_path)
+            return False
+        with self._lock:
+            self._set_version(snapshot.version, snapshot.updated_at)
+            self._snapshot = snapshot
+            self._products = None
+        logger.info("Mapped catalog snapshot", extra={"version": snapshot.version, "products": len(snapshot)})
+        return True
+
+    def _is_fresh(self) -> bool:
+        # Loaded state stays valid until an invalidation drops it
+        return self._products is not None or self._snapshot is not None
+
+    def _apply_pending(self):
+        """Re-read the products other requests changed and patch them into the loaded catalog"""
+        product_ids, self._pending = self._pending, set()
+        if not product_ids or not self._is_fresh():
+            return  # Nothing loaded yet; the full load reads them anyway
+
+        ordered = sorted(product_ids)
+        rows: List[dict] = []
+        db = SessionLocal()
+        try:
+            for start in range(0, len(ordered), PATCH_BATCH_SIZE):
+                chunk = ordered[start:start + PATCH_BATCH_SIZE]
+                rows += product_rows_to_dicts(db.execute(select_products().where(Product.id.in_(chunk))))
+        finally:
+            db.close()
+
+        if self._products is None:
+            # The mapped file predates the change; work on decoded products from here on
+            self._use(self._snapshot.products())
+        self._snapshot = None
+        self._patch(product_ids, {row["id"]: row for row in rows})
+
+    def _patch(self, product_ids: Set[int], changed: Dict[int, dict]):
+        """Swap in the active rows in `changed`; products in `product_ids` without a row are removed"""
+        old = [self._by_id[product_id] for product_id in product_ids if product_id in self._by_id]
+        genders = {product["gender"] for product in old} | {product["gender"] for product in changed.values()}
+
+        in_place = len(old) == len(product_ids) == len(changed) and all(
+            all(product[field] == changed[product["id"]][field] for field in INDEXED_FIELDS) for product in old
+        )
+        if in_place:
+            # Same products, same facet values: replace the dicts where they sit
+            positions = {product["id"]: position for position, product in enumerate(self._products)}
+            for product_id, product in changed.items():
+                self._products[positions[product_id]] = product
+                self._by_id[product_id] = product
+                self._by_sku[product["sku"]] = product
+        else:
+            products = [product for product in self._products if product["id"] not in product_ids]
+            products = sorted(products + list(changed.values()), key=lambda product: product["id"])
+            self._use(products)
+
+        # Only the listings and pages showing these products are rebuilt
+        self._json.pop(None, None)
+        for gender in genders:
+            self._json.pop(gender, None)
+        self._revision += 1
+        for key in genders | product_ids:
+            self._revisions[key] = self._revision
+        self.updated_at = time.time()
+
+    def _ensure_fresh(self):
+        cache.poll()
+        if self._pending:
+            with self._lock:
+                self._apply_pending()
+        if self._is_fresh():
+            return
+        with self._lock:
+            if not self._is_fresh():
+                self._load()
+
+    def _ensure_decoded(self):
+        """Make sure products are available as dicts (decoding the snapshot on first need)"""
+        self._ensure_fresh()
+        if self._products is None:
+            with self._lock:
+                snapshot = self._snapshot
+                if self._products is None and snapshot is not None:
+                    self._use(snapshot.products())
+                elif self._products is None:
+                    self._load()
+
+    def get_version(self) -> str:
+        """Current catalog version (changes whenever active product data changes)"""
+        self._ensure_fresh()
+        return f"{self.version}.{self._revision}" if self._revision else self.version
+
+    def page_version(self, key) -> str:
+        """Version of what a page shows, by gender (listing) or product ID; other changes leave it alone"""
+        self._ensure_fresh()
+        return f"{self.version}.{self._revisions.get(key, 0)}"
+
+    def get_products(self, gender: Optional[str] = None) -> List[dict]:
+        """All active products, optionally filtered by gender"""
+        self._ensure_decoded()
+        if gender:
+            return [product for product in self._products if product["gender"] == gender.lower()]
+        return self._products
+
+    def get_products_json(self, gender: Optional[str] = None, category: Optional[str] = None) -> bytes:
+        """Encoded listing of active products, optionally by gender and category
+
+        Gender listings are reused until the catalog changes; category listings
+        (any substring a client sends) are assembled per request.
+        """
+        self._ensure_fresh()
+        if category:
+            snapshot = self._snapshot
+            if snapshot is not None:
+                return snapshot.products_json(snapshot.positions(gender, category))
+            self._ensure_decoded()
+            facets = self._facets
+            return dumps(facets.select(facets.filter_mask(gender, category)))
+
+        key = gender.lower() if gender else None
+        encoded = self._json.get(key)
+        if encoded is None:
+            snapshot = self._snapshot
+            if snapshot is not None:
+                encoded = snapshot.products_json(snapshot.positions(key))
+            else:
+                encoded = dumps(self.get_products(key))
+            self._json[key] = encoded
+        return encoded
+
+    def get_product(self, product_id: int) -> Optional[dict]:
+        """A single active product, or None"""
+        self._ensure_fresh()
+        snapshot = self._snapshot
+        if self._products is None and snapshot is not None:
+            # Decode just this product from the mapped file
+            position = snapshot.position(product_id)
+            return snapshot.product(position) if position is not None else None
+        self._ensure_decoded()
+        return self._by_id.get(product_id)
+
+    def peek_product(self, product_id: int) -> Optional[dict]:
+        """Like get_product, but never loads the catalog; None if it isn't loaded"""
+        cache.poll()
+        if not self._is_fresh():
+            return None
+        return self.get_product(product_id)
+
+    def peek_product_by_sku(self, sku: str) -> Optional[dict]:
+        """An active product by SKU if the catalog is loaded, else None (never loads it)"""
+        cache.poll()
+        if not self._is_fresh():
+            return None
+        self._ensure_fresh()
+        snapshot = self._snapshot
+        if self._products is None and snapshot is not None:
+            position = snapshot.sku_position(sku)
+            return snapshot.product(position) if position is not None else None
+        return self._by_sku.get(sku)
+
+    def filter_products(self, gender=None, category=None, sizes=None, colors=None) -> List[dict]:
+        """Active products matching every given filter; sizes/colors match any listed value"""
+        self._ensure_decoded()
+        facets = self._facets
+        return facets.select(facets.filter_mask(gender, category, sizes, colors))
+
+    def facet_counts(self, gender=None, category=None, sizes=None, colors=None) -> dict:
+        """Total matches plus per-size and per-color counts
+
+        Each facet is counted with every filter except its own, so the counts show
+        what selecting another value of that facet would return.
+        """
+        self._ensure_decoded()
+        facets = self._facets
+        return {
+            "total": facets.filter_mask(gender, category, sizes, colors).bit_count(),
+            "sizes": facets.counts("size", facets.filter_mask(gender, category, sizes, colors, skip="size")),
+            "colors": facets.counts("color", facets.filter_mask(gender, category, sizes, colors, skip="color")),
+            "categories": facets.counts("category", facets.filter_mask(gender, None, sizes, colors)),
+        }
+
+    def invalidate(self):
+        """Force the next lookup to re-read the catalog, in every worker"""
+        with self._lock:
+            self._drop()
+        cache.invalidate("catalog")
+
+
+# Global catalog cache instance
+catalog_cache = CatalogCache()
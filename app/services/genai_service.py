@@ -1,12 +1,20 @@
 from dotenv import load_dotenv
 import os
-from google import genai
-from google.genai import types
 from PIL import Image
-import pathlib
+import logging
+import threading
+from typing import Optional, Tuple
+
+from app.utils.tracing import span
+
+logger = logging.getLogger(__name__)
 
 load_dotenv()
-client = genai.Client(api_key=os.getenv("GOOGLE_API_KEY"))
+
+# The google.genai SDK is slow to import and the client validates the API key
+# on construction, so both are deferred until the first generation request.
+_client = None
+_client_lock = threading.Lock()
 
 TEXT_MODEL = "gemini-2.5-flash"
 IMAGE_MODEL = "gemini-2.5-flash-image-preview"
@@ -38,35 +46,47 @@ IMAGE_PROMPT = (
 "professional lightening. Keep the person details."
 )
 
-def save_image(response, path):
-    # Ensure the directory exists
-    path_obj = pathlib.Path(path)
-    path_obj.parent.mkdir(parents=True, exist_ok=True)
-    
-    saved = False
-    for i, part in enumerate(response.parts):
-        if image := part.as_image():
-            image.save(path)
-            print(f"Image saved to: {path}")
-            saved = True
-            break
-    
-    if not saved:
-        print("No image found in response parts")
-        print(f"Response has {len(response.parts)} parts")
-        for i, part in enumerate(response.parts):
-            if hasattr(part, 'inline_data'):
-                print(f"Part {i} has inline_data with mime_type: {getattr(part.inline_data, 'mime_type', 'unknown')}")
-            else:
-                print(f"Part {i} type: {type(part)}")
+def get_client():
+    """Return the shared GenAI client, creating it on first use"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from google import genai
+                _client = genai.Client(api_key=os.getenv("GOOGLE_API_KEY"))
+                logger.info("GenAI client initialized")
+    return _client
+
+
+def extract_image(response) -> Optional[Tuple[bytes, str]]:
+    """Raw bytes and MIME type of the first image part of a response, without decoding it"""
+    for part in response.parts or []:
+        inline_data = getattr(part, "inline_data", None)
+        if inline_data is not None and inline_data.data:
+            return inline_data.data, inline_data.mime_type or "image/png"
+    return None
+
+
+def load_input_image(path: str, max_side: Optional[int] = None) -> Image.Image:
+    """Open an input image, downscaled so its longest side is at most `max_side`"""
+    image = Image.open(path)
+    if max_side and max(image.size) > max_side:
+        image.draft("RGB", (max_side, max_side))  # JPEGs decode at reduced scale
+        image = image.convert("RGB")
+        image.thumbnail((max_side, max_side))
+    return image
 
 
 def generate_product_image(
         product_image_path: str,
         user_image_path: str,
-        prompt: str = IMAGE_PROMPT):
-    """Generate a new product image using GenAI"""
+        prompt: str = IMAGE_PROMPT,
+        model: str = IMAGE_MODEL,
+        max_input_side: Optional[int] = None):
+    """Generate a new product image using GenAI; smaller inputs and a lighter model respond faster"""
     
+    from google.genai import types
+
     try:
         # Check if files exist
         if not os.path.exists(product_image_path):
@@ -74,22 +94,33 @@ def generate_product_image(
         if not os.path.exists(user_image_path):
             raise FileNotFoundError(f"User image not found: {user_image_path}")
         
-        contents = [
-            prompt,
-            Image.open(product_image_path),
-            Image.open(user_image_path)
-        ]
-        response = client.models.generate_content(
-            model=IMAGE_MODEL,
-            contents=contents,
-            config=types.GenerateContentConfig(
-                response_modalities=['Text', 'Image']
+        with span("load_inputs", max_input_side=max_input_side) as extra:
+            product_image = load_input_image(product_image_path, max_input_side)
+            user_image = load_input_image(user_image_path, max_input_side)
+            # Decoding happens lazily; force it here so this stage is what it says
+            product_image.load()
+            user_image.load()
+            extra["file_bytes"] = os.path.getsize(product_image_path) + os.path.getsize(user_image_path)
+            extra["pixels"] = product_image.width * product_image.height + user_image.width * user_image.height
+        contents = [prompt, product_image, user_image]
+        
+        # The SDK encodes the inputs, uploads them and waits for the model in this one call
+        with span("model_call", model=model) as extra:
+            response = get_client().models.generate_content(
+                model=model,
+                contents=contents,
+                config=types.GenerateContentConfig(
+                    response_modalities=['Text', 'Image']
+                )
             )
-        )
-        print(response)
+            extra["response_bytes"] = sum(
+                len(part.inline_data.data) for part in response.parts or []
+                if getattr(part, "inline_data", None) is not None and part.inline_data.data
+            )
+        logger.debug("Model response: %s", response)
         return response
-    except Exception as e:
-        print(f"Error generating product image: {e}")
+    except Exception:
+        logger.exception("Error generating product image")
         raise
 
 
@@ -100,7 +131,12 @@ if __name__ == "__main__":
             product_image_path="static/products/04302340500-e1.jpg",
             user_image_path="static/uploads/profile_images/620fca22-a0da-485c-ad43-4c71cca08809.png"
         )
-        save_image(response, "static/generated/generated_image.png")
+        from app.utils.image_cache import write_image_file
+        image = extract_image(response)
+        if image is None:
+            raise ValueError("No image found in response parts")
+        data, mime_type = image
+        write_image_file(data, "static/generated/generated_image.png", mime_type)
         print("Image generation completed successfully!")
     except Exception as e:
         print(f"Error in main execution: {e}")
@@ -0,0 +1,151 @@
+import logging
+import os
+from typing import Dict, Iterable, List, Set
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from app.models import Product
+from app.schemas import PriceUpdate, ProductUpsert
+from app.services.catalog_service import CATALOG_SNAPSHOT_PATH, write_catalog_snapshot
+from app.utils.cache import cache
+from app.utils.image_cache import image_cache
+from app.utils.image_metadata import product_image_metadata
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+ADMIN_BATCH_SIZE = int(os.getenv("ADMIN_BATCH_SIZE", "500"))  # Products per transaction
+
+# Fields an upsert may change (the SKU identifies the product)
+UPSERT_FIELDS = (
+    "name", "price", "category", "image", "description", "sizes", "colors", "gender", "is_active", "additional_data",
+)
+
+
+def batches(items: List, size: int = ADMIN_BATCH_SIZE) -> Iterable[List]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def invalidate_products(products: Iterable[tuple], image_changed: Set[int] = frozenset()):
+    """Drop cached entries for the given (id, sku) pairs only, in every worker
+
+    Called once per request, after every batch has committed. Each worker's
+    catalog patches in just these products on its next use.
+    """
+    products = list(products)
+    if not products:
+        return
+    # Rewrite the snapshot file first, so workers started from now on see the change
+    if CATALOG_SNAPSHOT_PATH:
+        try:
+            write_catalog_snapshot()
+        except OSError:
+            logger.exception("Could not write catalog snapshot")
+    keys = []
+    for product_id, sku in products:
+        keys += [f"product:{product_id}", f"product:sku:{sku}"]
+    cache.invalidate_keys(keys)
+    # Personalized images were generated from the old photo
+    for product_id in image_changed:
+        image_cache.clear_product_cache(product_id)
+
+
+def upsert_products(db: Session, items: List[ProductUpsert]) -> dict:
+    """Create or update products by SKU, one transaction per batch"""
+    result = {"created": 0, "updated": 0, "unchanged": 0, "images_changed": 0}
+    # A SKU listed twice takes its last entry
+    by_sku: Dict[str, ProductUpsert] = {item.sku: item for item in items}
+    touched, images_changed = [], set()
+
+    for batch in batches(list(by_sku.values())):
+        existing = {
+            product.sku: product
+            for product in db.scalars(select(Product).where(Product.sku.in_([item.sku for item in batch])))
+        }
+        created, changed, image_changed = [], [], set()
+        for item in batch:
+            # Omitting additional_data keeps the stored flags
+            data = item.model_dump(exclude_none=True)
+            product = existing.get(item.sku)
+            if product is None:
+                product = Product(**data, **product_image_metadata(item.image))
+                db.add(product)
+                created.append(product)
+                continue
+
+            changes = {
+                field: data[field] for field in UPSERT_FIELDS if field in data and getattr(product, field) != data[field]
+            }
+            if not changes:
+                result["unchanged"] += 1
+                continue
+            for field, value in changes.items():
+                setattr(product, field, value)
+            changed.append(product)
+            if "image" in changes:
+                image_changed.add(product.id)
+                metadata = product_image_metadata(product.image)
+                product.image_width = metadata.get("image_width")
+                product.image_height = metadata.get("image_height")
+                product.image_placeholder = metadata.get("image_placeholder")
+
+        db.commit()
+        result["created"] += len(created)
+        result["updated"] += len(changed)
+        result["images_changed"] += len(image_changed)
+        touched += [(product.id, product.sku) for product in created + changed]
+        images_changed |= image_changed
+
+    invalidate_products(touched, images_changed)
+    logger.info("Bulk product upsert", extra={"result": result})
+    return result
+
+
+def update_prices(db: Session, updates: List[PriceUpdate]) -> dict:
+    """Set prices by SKU, one transaction per batch"""
+    result = {"updated": 0, "unchanged": 0, "not_found": []}
+    prices = {item.sku: item.price for item in updates}
+    touched = []
+
+    for batch in batches(list(prices)):
+        rows = db.execute(select(Product.id, Product.sku, Product.price).where(Product.sku.in_(batch))).all()
+        found = {row.sku for row in rows}
+        result["not_found"] += [sku for sku in batch if sku not in found]
+
+        changed = [row for row in rows if row.price != prices[row.sku]]
+        result["unchanged"] += len(rows) - len(changed)
+        if changed:
+            # ORM bulk UPDATE by primary key: one executemany, no objects loaded
+            db.execute(update(Product), [{"id": row.id, "price": prices[row.sku]} for row in changed])
+            db.commit()
+            result["updated"] += len(changed)
+            touched += [(row.id, row.sku) for row in changed]
+
+    invalidate_products(touched)
+    logger.info("Bulk price update", extra={"result": result})
+    return result
+
+
+def deactivate_products(db: Session, skus: List[str]) -> dict:
+    """Hide products by SKU, one transaction per batch; personalized images are kept"""
+    result = {"deactivated": 0, "unchanged": 0, "not_found": []}
+    touched = []
+
+    for batch in batches(list(dict.fromkeys(skus))):
+        rows = db.execute(select(Product.id, Product.sku, Product.is_active).where(Product.sku.in_(batch))).all()
+        found = {row.sku for row in rows}
+        result["not_found"] += [sku for sku in batch if sku not in found]
+
+        active = [row for row in rows if row.is_active]
+        result["unchanged"] += len(rows) - len(active)
+        if active:
+            db.execute(update(Product).where(Product.id.in_([row.id for row in active])).values(is_active=False))
+            db.commit()
+            result["deactivated"] += len(active)
+            touched += [(row.id, row.sku) for row in active]
+
+    invalidate_products(touched)
+    logger.info("Bulk product deactivation", extra={"result": result})
+    return result
@@ -0,0 +1,204 @@
+import bisect
+import logging
+import math
+import mmap
+import os
+import re
+import struct
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from app.database import SessionLocal
+from app.services.catalog_service import select_products
+from app.utils.cache import cache
+from app.utils.serialization import product_rows_to_dicts
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Configuration
+RELATED_INDEX_PATH = os.getenv("RELATED_INDEX_PATH", "related_index.bin")
+RELATED_TOP_K = int(os.getenv("RELATED_TOP_K", "12"))  # Neighbours stored per product
+
+# File layout (little-endian): header, then ids[n] (sorted), neighbours[n*k], scores[n*k]
+_MAGIC = b"RELI"
+_HEADER = struct.Struct("<4sII")  # magic, product count, neighbours per product
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+_STOPWORDS = {
+    "a", "an", "and", "at", "by", "for", "from", "in", "made", "of", "on", "or", "the", "to", "with",
+    "featuring", "fabric",
+}
+_NAME_WEIGHT = 2  # Name words count this many times as description words
+_CATEGORY_WEIGHT = 3
+
+
+def tokenize(product: dict) -> List[str]:
+    """Weighted terms describing a product for similarity"""
+    def words(text: str) -> List[str]:
+        return [word for word in _TOKEN_PATTERN.findall(text.lower()) if word not in _STOPWORDS and len(word) > 1]
+
+    terms = words(product["name"]) * _NAME_WEIGHT + words(product["description"])
+    terms += [f"category:{product['category'].lower()}"] * _CATEGORY_WEIGHT
+    terms += [f"color:{color.lower()}" for color in product["colors"]]
+    return terms
+
+
+def compute_neighbours(products: List[dict], k: int, block_size: int = 512) -> Tuple["np.ndarray", "np.ndarray"]:
+    """Top-k cosine neighbours over TF-IDF vectors, only within the same section (gender)"""
+    import numpy as np  # Only building the index needs NumPy; serving it reads the file directly
+
+    neighbours = np.zeros((len(products), k), dtype="<i4")
+    scores = np.zeros((len(products), k), dtype="<f4")
+
+    by_gender: Dict[str, List[int]] = {}
+    for row, product in enumerate(products):
+        by_gender.setdefault(product["gender"], []).append(row)
+
+    for rows in by_gender.values():
+        counts = [Counter(tokenize(products[row])) for row in rows]
+        document_frequency = Counter(term for count in counts for term in count)
+        # Terms in a single document can't make two documents similar, so they are dropped
+        vocabulary = {term: column for column, term in enumerate(t for t, df in document_frequency.items() if df > 1)}
+        if not vocabulary:
+            continue
+
+        n = len(rows)
+        matrix = np.zeros((n, len(vocabulary)), dtype=np.float32)
+        for i, count in enumerate(counts):
+            for term, tf in count.items():
+                column = vocabulary.get(term)
+                if column is not None:
+                    idf = math.log((1 + n) / (1 + document_frequency[term])) + 1
+                    matrix[i, column] = (1 + math.log(tf)) * idf
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms == 0, 1, norms)
+
+        ids = np.array([products[row]["id"] for row in rows], dtype="<i4")
+        take = min(k, n - 1)
+        if take <= 0:
+            continue
+        for start in range(0, n, block_size):
+            similarity = matrix[start:start + block_size] @ matrix.T
+            block = np.arange(similarity.shape[0])
+            similarity[block, block + start] = -1  # Never relate a product to itself
+            top = np.argpartition(-similarity, take - 1, axis=1)[:, :take]
+            top_scores = np.take_along_axis(similarity, top, axis=1)
+            order = np.argsort(-top_scores, axis=1)
+            top = np.take_along_axis(top, order, axis=1)
+            top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+            targets = np.array(rows[start:start + block_size])
+            neighbours[targets, :take] = ids[top]
+            scores[targets, :take] = top_scores
+
+    return neighbours, scores
+
+
+def write_index(path: str, products: List[dict], k: int = RELATED_TOP_K):
+    """Compute neighbours and write the index file atomically"""
+    import numpy as np
+
+    products = sorted(products, key=lambda product: product["id"])
+    neighbours, scores = compute_neighbours(products, k)
+    ids = np.array([product["id"] for product in products], dtype="<i4")
+
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as file:
+        file.write(_HEADER.pack(_MAGIC, len(products), k))
+        file.write(ids.tobytes())
+        file.write(neighbours.tobytes())
+        file.write(scores.tobytes())
+    os.replace(temp_path, path)
+
+
+def build_related_index(path: str = RELATED_INDEX_PATH, k: int = RELATED_TOP_K) -> int:
+    """Build the index from the active catalog and tell every worker to reload it"""
+    db = SessionLocal()
+    try:
+        products = product_rows_to_dicts(db.execute(select_products()))
+    finally:
+        db.close()
+
+    write_index(path, products, k)
+    cache.invalidate("related")
+    logger.info("Built related-products index", extra={"products": len(products), "k": k, "path": path})
+    return len(products)
+
+
+class RelatedIndex:
+    """Read-only, memory-mapped view of the related-products index
+
+    The file's pages live in the OS page cache, so all workers share one copy.
+    """
+
+    def __init__(self, path: str = RELATED_INDEX_PATH):
+        self.path = path
+        self._map: Optional[mmap.mmap] = None
+        self._ids = None
+        self._neighbours = None
+        self._scores = None
+        self.k = 0
+        self._loaded = False
+        self._lock = threading.Lock()
+        # A rebuild anywhere broadcasts "related"; reopen the new file on next use
+        cache.subscribe("related", self.reset)
+
+    def load(self) -> bool:
+        """Map the index file; False if it has not been built"""
+        with self._lock:
+            if self._loaded:
+                return self._map is not None
+            self._loaded = True
+            try:
+                with open(self.path, "rb") as file:
+                    mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except (FileNotFoundError, ValueError):
+                logger.info("No related-products index at %s", self.path)
+                return False
+
+            magic, count, k = _HEADER.unpack_from(mapped)
+            if magic != _MAGIC:
+                logger.warning("Ignoring invalid related-products index at %s", self.path)
+                mapped.close()
+                return False
+            view = memoryview(mapped)
+            offset = _HEADER.size
+            self._ids = view[offset:offset + count * 4].cast("i")
+            offset += count * 4
+            self._neighbours = view[offset:offset + count * k * 4].cast("i")
+            offset += count * k * 4
+            self._scores = view[offset:offset + count * k * 4].cast("f")
+            self._map, self.k = mapped, k
+            return True
+
+    def reset(self, prefix: str = ""):
+        """Forget the mapping; the next lookup reopens the (possibly rebuilt) file"""
+        with self._lock:
+            # Views are left for the garbage collector: requests may still be reading them
+            self._map = self._ids = self._neighbours = self._scores = None
+            self._loaded = False
+
+    def lookup(self, product_id: int, limit: int) -> List[Tuple[int, float]]:
+        """Most similar (product_id, score) pairs, best first"""
+        if not self._loaded:
+            self.load()
+        ids, neighbours, scores = self._ids, self._neighbours, self._scores
+        if ids is None:
+            return []
+        row = bisect.bisect_left(ids, product_id)
+        if row == len(ids) or ids[row] != product_id:
+            return []
+        start = row * self.k
+        return [
+            (neighbours[i], scores[i])
+            for i in range(start, start + min(limit, self.k))
+            if scores[i] > 0  # Padding and unrelated candidates score 0
+        ]
+
+
+# Global related-products index instance
+related_index = RelatedIndex()
@@ -0,0 +1,99 @@
+import logging
+import os
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import delete, func, select
+
+from app.database import engine
+from app.models import GenerationTrace
+from app.utils.tracing import Trace
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Configuration
+GENERATION_TRACE_RETENTION = int(os.getenv("GENERATION_TRACE_RETENTION", "2000"))  # Most recent job traces kept
+
+PERCENTILES = (0.5, 0.9, 0.99)
+
+
+def save_trace(trace: Trace, retention: int = GENERATION_TRACE_RETENTION):
+    """Store a finished job's trace and drop the oldest beyond the retention (blocking)"""
+    with engine.begin() as connection:
+        result = connection.execute(GenerationTrace.__table__.insert().values(
+            user_id=trace.attributes.get("user_id"),
+            product_id=trace.attributes.get("product_id"),
+            status=trace.status,
+            total_ms=trace.total_ms,
+            attributes=trace.attributes,
+            spans=trace.spans,
+            created_at=trace.created_at,
+        ))
+        newest = result.inserted_primary_key[0]
+        # Ids only grow, so everything at or below newest - retention is the overflow
+        if newest > retention:
+            connection.execute(delete(GenerationTrace).where(GenerationTrace.id <= newest - retention))
+
+
+def recent_traces(limit: int = 50, status: Optional[str] = None) -> List[dict]:
+    """The most recent job traces, newest first"""
+    query = select(GenerationTrace).order_by(GenerationTrace.id.desc()).limit(limit)
+    if status:
+        query = query.where(GenerationTrace.status == status)
+    with engine.connect() as connection:
+        rows = connection.execute(query).mappings().all()
+    return [{**row, "created_at": row["created_at"].isoformat()} for row in rows]
+
+
+def _percentile(ordered: List[float], q: float) -> float:
+    return ordered[int(q * (len(ordered) - 1))]
+
+
+def _distribution(values: List[float]) -> Dict[str, float]:
+    ordered = sorted(values)
+    summary = {f"p{round(q * 100)}": _percentile(ordered, q) for q in PERCENTILES}
+    summary["mean"] = round(sum(ordered) / len(ordered), 1)
+    summary["max"] = ordered[-1]
+    return summary
+
+
+def summarize_traces(window: int = 500) -> dict:
+    """Per-stage latency percentiles (ms) and mean byte sizes over the last `window` jobs"""
+    query = select(GenerationTrace.status, GenerationTrace.total_ms, GenerationTrace.spans)
+    query = query.order_by(GenerationTrace.id.desc()).limit(window)
+    with engine.connect() as connection:
+        rows = connection.execute(query).all()
+        stored = connection.scalar(select(func.count()).select_from(GenerationTrace))
+
+    statuses: Dict[str, int] = defaultdict(int)
+    totals: List[float] = []
+    durations: Dict[str, List[float]] = defaultdict(list)
+    sizes: Dict[str, Dict[str, List[int]]] = defaultdict(lambda: defaultdict(list))
+    for status, total_ms, spans in rows:
+        statuses[status] += 1
+        if status == "succeeded" and total_ms is not None:
+            totals.append(total_ms)
+        for record in spans or []:
+            durations[record["name"]].append(record["duration_ms"])
+            for key, value in record.items():
+                if key.endswith("_bytes") and isinstance(value, int):
+                    sizes[record["name"]][key].append(value)
+
+    stages = {}
+    for name, values in durations.items():
+        stages[name] = {"count": len(values), **_distribution(values)}
+        for key, values_bytes in sizes[name].items():
+            stages[name][f"mean_{key}"] = round(sum(values_bytes) / len(values_bytes))
+    # Slowest stages first, by p90
+    stages = dict(sorted(stages.items(), key=lambda item: item[1]["p90"], reverse=True))
+
+    return {
+        "jobs": len(rows),
+        "stored": stored,
+        "statuses": dict(statuses),
+        "succeeded_total_ms": _distribution(totals) if totals else None,
+        "stages": stages,
+    }
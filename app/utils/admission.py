@@ -0,0 +1,189 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import os
+from contextlib import asynccontextmanager
+from typing import List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Configuration
+GENERATION_CONCURRENCY = int(os.getenv("GENERATION_CONCURRENCY", "4"))  # Concurrent model calls per process
+# Jobs running or waiting in this process; at the soft limit listing cards are deferred and
+# admitted jobs run degraded, at the hard limit even the product being viewed must retry later.
+# Unset, they are 2x and 4x the process's concurrency
+GENERATION_QUEUE_SOFT_LIMIT = int(os.getenv("GENERATION_QUEUE_SOFT_LIMIT", "0"))
+GENERATION_QUEUE_HARD_LIMIT = int(os.getenv("GENERATION_QUEUE_HARD_LIMIT", "0"))
+GENERATION_LATENCY_TARGET = float(os.getenv("GENERATION_LATENCY_TARGET", "20"))  # Seconds; slower recent calls mean pressure
+GENERATION_FALLBACK_MODEL = os.getenv("GENERATION_FALLBACK_MODEL", "")  # Cheaper image model under pressure, "" = keep
+GENERATION_DEGRADED_INPUT_SIDE = int(os.getenv("GENERATION_DEGRADED_INPUT_SIDE", "512"))  # Input downscale under pressure
+
+LATENCY_SMOOTHING = 0.2  # Weight of the newest call in the latency average
+RETRY_AFTER_BOUNDS = (5, 60)  # Seconds a deferred client is asked to wait
+
+# Request priorities, lower runs first
+PRIORITY_VIEW = 0  # The product page the shopper is looking at
+PRIORITY_BROWSE = 1  # A visible card in a listing
+PRIORITIES = {"view": PRIORITY_VIEW, "browse": PRIORITY_BROWSE}
+
+
+class PrioritySlots:
+    """Concurrency limit that hands a freed slot to the highest-priority waiter (FIFO within a priority)"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.running = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for _, _, future in self._waiters if not future.done())
+
+    async def acquire(self, priority: int):
+        if self.running < self.limit and not self.waiting:
+            self.running += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # The slot may have been handed over just as the waiter was cancelled
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)  # The slot passes straight to the waiter
+                return
+        self.running -= 1
+
+
+class AdmissionController:
+    """Decides whether a generation request may queue, and how cheaply admitted jobs run
+
+    Pressure is the number of jobs running or waiting in this process, or a recent
+    average model latency above target. Under pressure, listing cards are deferred
+    (the client retries after a delay), admitted jobs use the fallback model and
+    smaller inputs, and queued jobs for the viewed product go ahead of listing cards.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = GENERATION_CONCURRENCY,
+        soft_limit: int = GENERATION_QUEUE_SOFT_LIMIT,
+        hard_limit: int = GENERATION_QUEUE_HARD_LIMIT,
+        latency_target: float = GENERATION_LATENCY_TARGET,
+    ):
+        self.slots = PrioritySlots(concurrency)
+        self._soft_limit = soft_limit
+        self._hard_limit = hard_limit
+        self.latency_target = latency_target
+        self.latency: Optional[float] = None  # Smoothed seconds per model call
+        # Jobs admitted but not yet queued for a slot (their tasks haven't started). Counting
+        # them keeps a burst of requests from all being admitted against the same depth
+        self.pending = 0
+        self.deferred = 0
+        self.degraded = 0
+
+    @property
+    def concurrency(self) -> int:
+        return self.slots.limit
+
+    @concurrency.setter
+    def concurrency(self, limit: int):
+        self.slots.limit = limit
+
+    @property
+    def soft_limit(self) -> int:
+        return self._soft_limit or self.slots.limit * 2
+
+    @property
+    def hard_limit(self) -> int:
+        return self._hard_limit or self.slots.limit * 4
+
+    def depth(self) -> int:
+        return self.slots.running + self.slots.waiting + self.pending
+
+    def under_pressure(self) -> bool:
+        depth = self.depth()
+        # Slowness only counts while work is queued, so an idle process always admits
+        # again and refreshes the average
+        slow = self.latency is not None and self.latency > self.latency_target and depth > 0
+        return slow or depth >= self.soft_limit
+
+    def retry_after(self) -> int:
+        """Seconds until the queue has likely drained enough to be worth retrying"""
+        per_call = self.latency or self.latency_target
+        estimate = math.ceil(per_call * self.depth() / self.slots.limit)
+        low, high = RETRY_AFTER_BOUNDS
+        return max(low, min(high, estimate))
+
+    def admit(self, priority: int) -> Optional[int]:
+        """None if the request may queue now, else the seconds the client should wait before retrying
+
+        An admitted job counts as pending until it enters slot(reserved=True), or
+        until cancel_reservation() if it never runs.
+        """
+        if priority == PRIORITY_VIEW:
+            admitted = self.depth() < self.hard_limit
+        else:
+            admitted = not self.under_pressure()
+        if admitted:
+            self.pending += 1
+            return None
+        self.deferred += 1
+        retry_after = self.retry_after()
+        logger.info("Generation request deferred", extra={
+            "priority": priority, "depth": self.depth(), "latency_s": self.latency, "retry_after": retry_after,
+        })
+        return retry_after
+
+    def cancel_reservation(self):
+        """Give back an admission whose job will not run (already cached, claimed elsewhere, ...)"""
+        self.pending = max(0, self.pending - 1)
+
+    def generation_options(self) -> dict:
+        """Keyword arguments for generate_product_image: cheaper settings while under pressure"""
+        if not self.under_pressure():
+            return {}
+        self.degraded += 1
+        options = {"max_input_side": GENERATION_DEGRADED_INPUT_SIDE}
+        if GENERATION_FALLBACK_MODEL:
+            options["model"] = GENERATION_FALLBACK_MODEL
+        return options
+
+    def record_latency(self, seconds: float):
+        if self.latency is None:
+            self.latency = seconds
+        else:
+            self.latency += LATENCY_SMOOTHING * (seconds - self.latency)
+
+    @asynccontextmanager
+    async def slot(self, priority: int = PRIORITY_BROWSE, reserved: bool = False, timeout: Optional[float] = None):
+        """Hold one of this process's model-call slots; `reserved` if admit() counted this job as pending
+
+        Raises asyncio.TimeoutError if no slot frees up within `timeout` seconds.
+        """
+        if reserved:
+            # From here the job is counted as waiting or running instead
+            self.cancel_reservation()
+        await asyncio.wait_for(self.slots.acquire(priority), timeout)
+        try:
+            yield
+        finally:
+            self.slots.release()
+
+
+# Global admission controller instance
+admission = AdmissionController()
@@ -1,15 +1,34 @@
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, Tuple
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import HTTPException, status, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+import hashlib
+import hmac
+import logging
+import os
+import secrets
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
 
 # Configuration
 SECRET_KEY = "your-secret-key-here"  # In production, use environment variable
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "30"))
+# Seconds a just-rotated refresh token is still accepted (concurrent refreshes from several tabs)
+REFRESH_TOKEN_REUSE_GRACE = int(os.getenv("REFRESH_TOKEN_REUSE_GRACE", "10"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))  # Seconds a resolved user stays in the shared cache
+# Accounts allowed to use the admin API (comma-separated emails)
+ADMIN_EMAILS = {email.strip().lower() for email in os.getenv("ADMIN_EMAILS", "").split(",") if email.strip()}
+
+# Columns copied into the user cache (never the password hash)
+USER_CACHE_FIELDS = ("id", "name", "email", "country", "gender", "image", "created_at", "is_active")
 
 # Password hashing context
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -36,6 +55,93 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def create_session_tokens(db: Session, user, family: Optional[str] = None) -> dict:
+    """Access token plus a new refresh token for `user`; the caller commits"""
+    access_token = create_access_token(
+        data={"sub": user.email, "user_id": user.id},
+        expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    )
+    return {
+        "access_token": access_token,
+        "refresh_token": issue_refresh_token(db, user.id, family),
+        "token_type": "bearer",
+        "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+    }
+
+def hash_refresh_token(token: str) -> str:
+    """Keyed SHA-256 of a refresh token; tokens are random, so a slow hash adds nothing"""
+    return hmac.new(SECRET_KEY.encode(), token.encode(), hashlib.sha256).hexdigest()
+
+def issue_refresh_token(db: Session, user_id: int, family: Optional[str] = None) -> str:
+    """Store a new refresh token's hash and return the token; the caller commits"""
+    from app.models import RefreshToken
+    
+    now = datetime.utcnow()
+    # Expired tokens are only kept until the user's next login or refresh
+    db.query(RefreshToken).filter(RefreshToken.user_id == user_id, RefreshToken.expires_at < now).delete()
+    
+    token = secrets.token_urlsafe(32)
+    db.add(RefreshToken(
+        user_id=user_id,
+        family=family or secrets.token_hex(16),
+        token_hash=hash_refresh_token(token),
+        created_at=now,
+        expires_at=now + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS),
+    ))
+    return token
+
+def rotate_refresh_token(db: Session, token: str) -> Tuple[object, dict]:
+    """
+    Exchange a refresh token for new session tokens (user, tokens).
+    Presenting an already-rotated token outside the grace window revokes its whole family
+    """
+    from app.models import RefreshToken, User
+    
+    invalid = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid refresh token",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    now = datetime.utcnow()
+    stored = db.query(RefreshToken).filter(RefreshToken.token_hash == hash_refresh_token(token)).first()
+    if stored is None or stored.revoked_at is not None or stored.expires_at < now:
+        raise invalid
+    
+    if stored.rotated_at is not None and now - stored.rotated_at > timedelta(seconds=REFRESH_TOKEN_REUSE_GRACE):
+        # A replaced token came back: it was copied, so end every session descended from that login
+        revoke_refresh_family(db, stored.family)
+        db.commit()
+        logger.warning("Refresh token reuse detected", extra={"user_id": stored.user_id})
+        raise invalid
+    
+    user = db.query(User).filter(User.id == stored.user_id, User.is_active == True).first()
+    if user is None:
+        raise invalid
+    
+    stored.rotated_at = stored.rotated_at or now
+    tokens = create_session_tokens(db, user, stored.family)
+    db.commit()
+    return user, tokens
+
+def revoke_refresh_family(db: Session, family: str):
+    """Revoke every token of one login; the caller commits"""
+    from app.models import RefreshToken
+    
+    db.query(RefreshToken).filter(
+        RefreshToken.family == family, RefreshToken.revoked_at.is_(None)
+    ).update({"revoked_at": datetime.utcnow()})
+
+def revoke_refresh_token(db: Session, token: str) -> bool:
+    """Log a session out: revoke the token's family. False if the token is unknown"""
+    from app.models import RefreshToken
+    
+    stored = db.query(RefreshToken).filter(RefreshToken.token_hash == hash_refresh_token(token)).first()
+    if stored is None:
+        return False
+    revoke_refresh_family(db, stored.family)
+    db.commit()
+    return True
+
 def verify_token(token: str) -> dict:
     """Verify and decode a JWT token"""
     try:
@@ -197,6 +303,35 @@ def get_current_user(
     
     return user
 
+def get_cached_user(user_id: int, user_email: str):
+    """
+    Resolve a token's user through the shared cache, falling back to the database.
+    Returns a detached User carrying the cached fields, or None
+    """
+    from app.database import SessionLocal
+    from app.models import User
+    from app.utils.cache import cache
+    
+    key = f"user:{user_id}"
+    data = cache.get(key)
+    if data is None:
+        db = SessionLocal()
+        try:
+            user = db.query(User).filter(User.id == user_id).first()
+        finally:
+            db.close()
+        if user is None:
+            return None
+        data = {field: getattr(user, field) for field in USER_CACHE_FIELDS}
+        cache.set(key, data, ttl=USER_CACHE_TTL)
+    
+    if data["email"] != user_email:
+        return None
+    if isinstance(data["created_at"], str):
+        # The shared cache stores JSON, which carries datetimes as ISO strings
+        data = {**data, "created_at": datetime.fromisoformat(data["created_at"])}
+    return User(**data)
+
 def get_current_user_optional(
     credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)
 ):
@@ -204,9 +339,6 @@ def get_current_user_optional(
     Optional authentication - returns user if authenticated, None if not
     Use this for endpoints where authentication is optional
     """
-    from app.database import get_db
-    from app.models import User
-    
     if not credentials:
         return None
     
@@ -219,21 +351,32 @@ def get_current_user_optional(
         if user_email is None or user_id is None:
             return None
         
-        # Get database session
-        db_gen = get_db()
-        db = next(db_gen)
-        try:
-            # Get user from database
-            user = db.query(User).filter(User.id == user_id, User.email == user_email).first()
-            return user
-        finally:
-            db.close()
+        # Get user from the shared cache (database on a miss)
+        return get_cached_user(user_id, user_email)
         
     except JWTError:
         return None
     except Exception:
         return None
 
+def get_current_admin(current_user = Depends(get_current_user_optional)):
+    """
+    Require an authenticated user whose email is listed in ADMIN_EMAILS
+    Usage: admin = Depends(get_current_admin)
+    """
+    if current_user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    if current_user.email.lower() not in ADMIN_EMAILS:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin access required"
+        )
+    return current_user
+
 def get_db_session():
     """Helper function to get database session"""
     from app.database import get_db
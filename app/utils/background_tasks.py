@@ -1,131 +1,298 @@
 import asyncio
-from fastapi import BackgroundTasks
-from typing import Optional
-from app.services.genai_service import generate_product_image, save_image
+import contextvars
+import functools
+import glob
+import json
+import logging
+import time
+from typing import Dict, List, Optional
+from app.services.analytics_service import analytics
+from app.services.genai_service import extract_image, generate_product_image
+from app.services.trace_service import save_trace
+from app.utils.admission import GENERATION_CONCURRENCY, PRIORITY_BROWSE, admission
+from app.utils.cache import cache
 from app.utils.image_cache import image_cache
+from app.utils.logging_config import request_id_var
+from app.utils.tracing import start_trace
 from app.models import User, Product
-import tempfile
 import os
 
+logger = logging.getLogger(__name__)
+
+# Configuration
+GENERATION_DRAIN_TIMEOUT = float(os.getenv("GENERATION_DRAIN_TIMEOUT", "30"))  # Seconds to wait on shutdown
+GENERATION_CHECKPOINT_PATH = os.getenv("GENERATION_CHECKPOINT_PATH", "generation_checkpoint.json")
+GENERATION_QUEUE_TIMEOUT = float(os.getenv("GENERATION_QUEUE_TIMEOUT", "300"))  # Seconds a job may wait for a slot
+GENERATION_CALL_TIMEOUT = 60.0  # Seconds before a model call is abandoned
+GENERATION_CLAIM_MARGIN = 30.0  # Seconds for input checks, extraction and the cache write around the call
+# A claim outlives the longest a job can hold it, so another worker never sees it lapse mid-job:
+# first the wait for a slot plus the call, then (renewed on entering the slot) just the call
+GENERATION_LOCK_TTL = GENERATION_QUEUE_TIMEOUT + GENERATION_CALL_TIMEOUT + GENERATION_CLAIM_MARGIN
+GENERATION_RUNNING_LOCK_TTL = GENERATION_CALL_TIMEOUT + GENERATION_CLAIM_MARGIN
+
 class ImageGenerationTask:
     def __init__(self):
-        self.active_generations = set()  # Track ongoing generations
+        self.active_generations: Dict[str, dict] = {}  # Ongoing generations and their job arguments
+        # Every job this process has scheduled and not yet finished, with its arguments. The
+        # manager owns these tasks (rather than the request's BackgroundTasks), so shutdown
+        # can wait for them up to the drain timeout, then checkpoint and cancel the rest
+        self._tasks: Dict[asyncio.Task, dict] = {}
     
     def is_generating(self, user_id: int, product_id: int) -> bool:
         """Check if image generation is already in progress for this user-product pair"""
         key = f"{user_id}_{product_id}"
-        return key in self.active_generations
+        # The shared cache holds claims from every worker on the host
+        return key in self.active_generations or cache.get(f"generation:{key}", local=False) is not None
+    
+    def start_generation(self, user_id: int, product_id: int, job: Optional[dict] = None) -> bool:
+        """Mark generation as started; returns False if another worker already owns it"""
+        key = f"{user_id}_{product_id}"
+        if key in self.active_generations or not cache.add(f"generation:{key}", os.getpid(), ttl=GENERATION_LOCK_TTL):
+            return False
+        self.active_generations[key] = job or {"user_id": user_id, "product_id": product_id}
+        return True
     
-    def start_generation(self, user_id: int, product_id: int):
-        """Mark generation as started"""
+    def renew_generation(self, user_id: int, product_id: int, ttl: float = GENERATION_RUNNING_LOCK_TTL):
+        """Restart this process's claim on a generation for another `ttl` seconds"""
         key = f"{user_id}_{product_id}"
-        self.active_generations.add(key)
+        if key in self.active_generations:
+            cache.set(f"generation:{key}", os.getpid(), ttl=ttl)
     
     def finish_generation(self, user_id: int, product_id: int):
         """Mark generation as finished"""
         key = f"{user_id}_{product_id}"
-        self.active_generations.discard(key)
+        if self.active_generations.pop(key, None) is not None:
+            cache.delete(f"generation:{key}")
+    
+    def schedule(self, reserved: bool = False, **job) -> asyncio.Task:
+        """Run generate_user_product_image(**job) as a task of this manager; call from the event loop
+
+        `reserved` if admission.admit() counted the job as pending; the job gives it back.
+        """
+        task = asyncio.create_task(self.generate_user_product_image(**job, reserved=reserved))
+        self._tasks[task] = job
+        task.add_done_callback(self._tasks.pop)
+        return task
+    
+    async def drain(self, timeout: float = GENERATION_DRAIN_TIMEOUT) -> List[dict]:
+        """Wait for scheduled generations to finish; cancel and return the jobs still unfinished at the deadline"""
+        if not self._tasks:
+            return []
+        _, pending = await asyncio.wait(list(self._tasks), timeout=timeout)
+        unfinished = [self._tasks[task] for task in pending]
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        return unfinished
+    
+    def checkpoint(self, jobs: List[dict], path: str = GENERATION_CHECKPOINT_PATH):
+        """Persist unfinished jobs so the next process can pick them up"""
+        resumable = [job for job in jobs if "user_image_path" in job]
+        if not resumable:
+            return
+        # One file per process so concurrent workers never overwrite each other
+        path = f"{path}.{os.getpid()}"
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(resumable, file)
+        logger.info("Checkpointed unfinished generations", extra={"count": len(resumable), "path": path})
+    
+    def resume(self, path: str = GENERATION_CHECKPOINT_PATH) -> int:
+        """Re-schedule jobs left by previous processes; must be called from the event loop"""
+        jobs = []
+        for checkpoint_path in glob.glob(f"{glob.escape(path)}.*"):
+            if ".resuming-" in checkpoint_path:
+                continue
+            # Renaming claims the file, so only one worker resumes it
+            claimed_path = f"{checkpoint_path}.resuming-{os.getpid()}"
+            try:
+                os.rename(checkpoint_path, claimed_path)
+            except FileNotFoundError:
+                continue
+            try:
+                with open(claimed_path, "r", encoding="utf-8") as file:
+                    jobs.extend(json.load(file))
+            finally:
+                os.unlink(claimed_path)
+        
+        for job in jobs:
+            self.schedule(**job)
+        logger.info("Resumed checkpointed generations", extra={"count": len(jobs)})
+        return len(jobs)
     
     async def generate_user_product_image(
         self, 
         user_id: int, 
         product_id: int, 
         user_image_path: str, 
-        product_image_path: str
+        product_image_path: str,
+        request_id: Optional[str] = None,
+        priority: int = PRIORITY_BROWSE,
+        reserved: bool = False
     ):
         """Background task to generate and cache user-product image"""
         generation_key = f"{user_id}_{product_id}"
+        # Tag every log line of this job with the request that triggered it
+        request_id_var.set(request_id)
+        log_extra = {"user_id": user_id, "product_id": product_id}
         
+        # Mark as generating (keeping the arguments so the job can be checkpointed)
+        if not self.start_generation(user_id, product_id, job={
+            "user_id": user_id,
+            "product_id": product_id,
+            "user_image_path": user_image_path,
+            "product_image_path": product_image_path,
+            "request_id": request_id,
+            "priority": priority,
+        }):
+            logger.debug("Image generation already in progress elsewhere", extra=log_extra)
+            if reserved:
+                admission.cancel_reservation()
+            return
+        
+        # Per-stage timings of this job, stored for /api/admin/generation-traces
+        trace = start_trace(user_id=user_id, product_id=product_id, priority=priority)
+        status = "error"
         try:
-            print(f"Starting background image generation for user {user_id}, product {product_id}")
-            
-            # Mark as generating
-            self.start_generation(user_id, product_id)
+            logger.info("Starting background image generation", extra=log_extra)
             
             # Check if already cached (double-check in case of race condition)
             if image_cache.is_cached(user_id, product_id):
-                print(f"Image already cached for user {user_id}, product {product_id}")
+                logger.debug("Image already cached", extra=log_extra)
+                status = "cached"
                 return
             
             # Convert relative paths to absolute paths
             import os
             
-            # Convert user image path (remove leading slash and prepend with current directory)
-            if user_image_path.startswith('/static/'):
-                user_image_path = user_image_path[1:]  # Remove leading slash
-            user_full_path = os.path.join(os.getcwd(), user_image_path)
-            
-            # Convert product image path
-            if product_image_path.startswith('/static/'):
-                product_image_path = product_image_path[1:]  # Remove leading slash
-            product_full_path = os.path.join(os.getcwd(), product_image_path)
-            
-            print(f"User image full path: {user_full_path}")
-            print(f"Product image full path: {product_full_path}")
+            with trace.span("resolve_paths"):
+                # Convert user image path (remove leading slash and prepend with current directory)
+                if user_image_path.startswith('/static/'):
+                    user_image_path = user_image_path[1:]  # Remove leading slash
+                user_full_path = os.path.join(os.getcwd(), user_image_path)
+                
+                # Convert product image path
+                if product_image_path.startswith('/static/'):
+                    product_image_path = product_image_path[1:]  # Remove leading slash
+                product_full_path = os.path.join(os.getcwd(), product_image_path)
+                
+                logger.debug("Resolved image paths: user=%s product=%s", user_full_path, product_full_path, extra=log_extra)
+                inputs_exist = os.path.exists(user_full_path), os.path.exists(product_full_path)
             
             # Check if files exist
-            if not os.path.exists(user_full_path):
-                print(f"User image not found: {user_full_path}")
+            if not inputs_exist[0]:
+                logger.warning("User image not found: %s", user_full_path, extra=log_extra)
+                status = "missing_input"
                 return
             
-            if not os.path.exists(product_full_path):
-                print(f"Product image not found: {product_full_path}")
+            if not inputs_exist[1]:
+                logger.warning("Product image not found: %s", product_full_path, extra=log_extra)
+                status = "missing_input"
                 return
             
             # Generate the image using asyncio to run in thread pool to prevent blocking
             import asyncio
             loop = asyncio.get_event_loop()
             
-            # Add timeout to prevent hanging (60 seconds max)
+            # Add timeouts to prevent hanging (for a slot, then for the call), limiting this
+            # process to its share of concurrent model calls; the viewed product goes first
+            started = None
             try:
-                response = await asyncio.wait_for(
-                    loop.run_in_executor(
-                        None,  # Use default thread pool
-                        generate_product_image,
-                        product_full_path,
-                        user_full_path
-                    ),
-                    timeout=60.0  # 60 second timeout
-                )
+                queued = time.perf_counter()
+                slot = admission.slot(priority, reserved=reserved, timeout=GENERATION_QUEUE_TIMEOUT)
+                reserved = False  # The slot takes the admission over when entered
+                async with slot:
+                    trace.mark("queue_wait", queued, depth=admission.depth())
+                    # However long the wait was, the claim now covers the whole call
+                    self.renew_generation(user_id, product_id)
+                    # Decided when the call starts, so it reflects the queue at that moment
+                    options = admission.generation_options()
+                    if options:
+                        logger.info("Generating in degraded mode", extra={**log_extra, **options})
+                        trace.attributes["degraded"] = options
+                    started = time.monotonic()
+                    response = await asyncio.wait_for(
+                        loop.run_in_executor(
+                            None,  # Use default thread pool
+                            # Carry the request ID into the worker thread
+                            functools.partial(
+                                contextvars.copy_context().run,
+                                functools.partial(generate_product_image, **options),
+                                product_full_path,
+                                user_full_path
+                            )
+                        ),
+                        timeout=GENERATION_CALL_TIMEOUT
+                    )
+                    admission.record_latency(time.monotonic() - started)
             except asyncio.TimeoutError:
-                print(f"Image generation timed out for user {user_id}, product {product_id}")
+                if started is None:
+                    logger.warning("Gave up waiting for a generation slot", extra=log_extra)
+                    status = "queue_timeout"
+                    return
+                # Count the timeout as a slow call so pressure is detected
+                admission.record_latency(GENERATION_CALL_TIMEOUT)
+                logger.warning("Image generation timed out", extra=log_extra)
+                status = "timeout"
                 return
             
-            # Save to temporary location first
-            with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as temp_file:
-                temp_path = temp_file.name
-            
-            save_image(response, temp_path)
-            
-            # Move to cache
-            cache_url = image_cache.save_generated_image(user_id, product_id, temp_path)
+            with trace.span("extract_image") as extra:
+                image = extract_image(response)
+                extra["image_bytes"] = len(image[0]) if image else 0
+            if image is None:
+                logger.warning("No image found in response parts", extra=log_extra)
+                status = "no_image"
+                return
             
-            # Clean up temporary file
-            os.unlink(temp_path)
+            # Write the response bytes straight into the cache, off the event loop
+            # (non-PNG responses are re-encoded here, which the MIME type attribute shows)
+            with trace.span("cache_write", mime_type=image[1]):
+                cache_url = await loop.run_in_executor(
+                    None, image_cache.write_generated_image, user_id, product_id, *image
+                )
             
-            print(f"Successfully generated and cached image for user {user_id}, product {product_id}")
-            print(f"Cache URL: {cache_url}")
+            status = "succeeded"
+            analytics.record_generation(user_id, product_id)
+            logger.info("Successfully generated and cached image", extra={**log_extra, "cache_url": cache_url})
             
-        except Exception as e:
-            print(f"Error generating image for user {user_id}, product {product_id}: {e}")
+        except asyncio.CancelledError:
+            # Shutdown reached the drain deadline; the job has been checkpointed
+            status = "cancelled"
+            raise
+        except Exception:
+            logger.exception("Error generating image", extra=log_extra)
         finally:
             # Always mark as finished
             self.finish_generation(user_id, product_id)
+            if reserved:
+                # Ended before queueing for a slot (cached, missing input, ...)
+                admission.cancel_reservation()
+            trace.finish(status)
+            await self._save_trace(trace)
+    
+    async def _save_trace(self, trace):
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, save_trace, trace)
+        except Exception:
+            logger.exception("Failed to store generation trace")
 
 # Global task manager
 image_task_manager = ImageGenerationTask()
 
 
 def trigger_image_generation(
-    background_tasks: BackgroundTasks,
     user: User,
-    product: Product
+    product: Product,
+    priority: int = PRIORITY_BROWSE,
+    reserved: bool = False
 ) -> Optional[str]:
     """
     Trigger image generation if needed and return cached image URL if available.
     Returns None if no cache exists and generation is starting.
+    `reserved` if admission.admit() admitted this request; it is given back if no job starts.
     """
     if not user or not user.image:
+        if reserved:
+            admission.cancel_reservation()
         return None
     
     user_id = user.id
@@ -134,22 +301,28 @@ def trigger_image_generation(
     # Check cache first
     cached_url = image_cache.get_cached_image_url(user_id, product_id)
     if cached_url:
-        print(f"Found cached image for user {user_id}, product {product_id}: {cached_url}")
+        logger.debug("Found cached image %s", cached_url, extra={"user_id": user_id, "product_id": product_id})
+        if reserved:
+            admission.cancel_reservation()
         return cached_url
     
     # Check if generation is already in progress
     if image_task_manager.is_generating(user_id, product_id):
-        print(f"Image generation already in progress for user {user_id}, product {product_id}")
+        logger.debug("Image generation already in progress", extra={"user_id": user_id, "product_id": product_id})
+        if reserved:
+            admission.cancel_reservation()
         return None
     
     # Start background generation
-    print(f"Starting background image generation for user {user_id}, product {product_id}")
-    background_tasks.add_task(
-        image_task_manager.generate_user_product_image,
+    logger.debug("Queueing background image generation", extra={"user_id": user_id, "product_id": product_id})
+    image_task_manager.schedule(
         user_id=user_id,
         product_id=product_id,
         user_image_path=user.image,
-        product_image_path=product.image
+        product_image_path=product.image,
+        request_id=request_id_var.get(),
+        priority=priority,
+        reserved=reserved
     )
     
     return None  # No cached image available yet
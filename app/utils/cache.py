@@ -0,0 +1,318 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import date
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Configuration
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "sqlite").lower()  # memory (single process) or sqlite (shared by workers)
+# Next to the database by default; never a shared temp directory other local users can write to
+CACHE_SQLITE_PATH = os.getenv("CACHE_SQLITE_PATH", "bananashop-cache.sqlite3")
+CACHE_LOCAL_TTL = float(os.getenv("CACHE_LOCAL_TTL", "5"))  # Max seconds a shared entry is served from process memory
+CACHE_INVALIDATION_POLL = float(os.getenv("CACHE_INVALIDATION_POLL", "0.1"))  # Seconds between invalidation checks
+CACHE_PRUNE_INTERVAL = 60.0  # Seconds between sweeps of expired entries and old invalidations
+INVALIDATION_RETENTION = 3600  # Seconds invalidation log entries are kept; pollers only need recent ones
+
+# Invalidation log entries starting with this name one exact key rather than a prefix
+EXACT_MARKER = "="
+
+
+def _json_default(value: Any) -> str:
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def encode_value(value: Any) -> str:
+    """Shared entries are stored as JSON (datetimes become ISO strings); never pickled"""
+    return json.dumps(value, separators=(",", ":"), default=_json_default)
+
+
+class MemoryCache:
+    """Process-local backend: a dict with per-entry expiry"""
+
+    shared = False
+
+    def __init__(self):
+        self._entries: Dict[str, Tuple[Any, Optional[float]]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at < time.time():
+            self._entries.pop(key, None)
+            return None
+        return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        self._entries[key] = (value, time.time() + ttl if ttl else None)
+
+    def add(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        with self._lock:
+            if self.get(key) is not None:
+                return False
+            self.set(key, value, ttl)
+            return True
+
+    def delete(self, key: str):
+        self._entries.pop(key, None)
+
+    def invalidate(self, prefix: str):
+        with self._lock:
+            for key in [key for key in self._entries if key.startswith(prefix)]:
+                del self._entries[key]
+
+    def invalidate_keys(self, keys: List[str]):
+        for key in keys:
+            self._entries.pop(key, None)
+
+    def poll_invalidations(self) -> List[str]:
+        return []
+
+
+class SQLiteCache:
+    """Host-wide backend in a WAL-mode SQLite file, with an invalidation log workers poll"""
+
+    shared = True
+
+    def __init__(self, path: str = CACHE_SQLITE_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._pid: Optional[int] = None
+        self._last_invalidation_id = 0
+        self._next_prune = 0.0
+
+    def _connection(self) -> sqlite3.Connection:
+        # One connection per thread, reopened after fork()
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache_entries "
+                "(key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache_invalidations "
+                "(id INTEGER PRIMARY KEY AUTOINCREMENT, prefix TEXT NOT NULL, origin INTEGER NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+            with self._init_lock:
+                if self._pid != os.getpid():
+                    # Only invalidations issued from now on concern this process
+                    row = conn.execute("SELECT COALESCE(MAX(id), 0) FROM cache_invalidations").fetchone()
+                    self._last_invalidation_id = row[0]
+                    self._pid = os.getpid()
+        return conn
+
+    def get(self, key: str) -> Any:
+        row = self._connection().execute(
+            "SELECT value, expires_at FROM cache_entries WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return None
+        try:
+            return json.loads(row[0])
+        except (ValueError, TypeError):
+            # Written by an older version in another format: treat as a miss
+            return None
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        conn = self._connection()
+        now = time.time()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache_entries (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, encode_value(value), now + ttl if ttl else None),
+        )
+        self._prune(conn, now)
+
+    def _prune(self, conn: sqlite3.Connection, now: float):
+        """Delete expired entries and old invalidations, at most every CACHE_PRUNE_INTERVAL seconds"""
+        if now < self._next_prune:
+            return
+        self._next_prune = now + CACHE_PRUNE_INTERVAL
+        conn.execute("DELETE FROM cache_entries WHERE expires_at < ?", (now,))
+        conn.execute("DELETE FROM cache_invalidations WHERE created_at < ?", (now - INVALIDATION_RETENTION,))
+
+    def add(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        now = time.time()
+        # Single statement, so it is atomic across processes: only replaces an expired entry
+        cursor = self._connection().execute(
+            "INSERT INTO cache_entries (key, value, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at "
+            "WHERE cache_entries.expires_at IS NOT NULL AND cache_entries.expires_at < ?",
+            (key, encode_value(value), now + ttl if ttl else None, now),
+        )
+        return cursor.rowcount == 1
+
+    def delete(self, key: str):
+        self._connection().execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+
+    def invalidate(self, prefix: str):
+        self._invalidate(
+            "DELETE FROM cache_entries WHERE substr(key, 1, ?) = ?", [(len(prefix), prefix)], [prefix]
+        )
+
+    def invalidate_keys(self, keys: List[str]):
+        self._invalidate(
+            "DELETE FROM cache_entries WHERE key = ?", [(key,) for key in keys], [EXACT_MARKER + key for key in keys]
+        )
+
+    def _invalidate(self, delete_sql: str, delete_params: List[tuple], events: List[str]):
+        """Delete entries and log the invalidation events in one transaction"""
+        conn = self._connection()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(delete_sql, delete_params)
+            conn.executemany(
+                "INSERT INTO cache_invalidations (prefix, origin, created_at) VALUES (?, ?, ?)",
+                [(event, os.getpid(), now) for event in events],
+            )
+            self._prune(conn, now)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def poll_invalidations(self) -> List[str]:
+        conn = self._connection()
+        rows = conn.execute(
+            "SELECT id, prefix, origin FROM cache_invalidations WHERE id > ? ORDER BY id",
+            (self._last_invalidation_id,),
+        ).fetchall()
+        if not rows:
+            return []
+        self._last_invalidation_id = rows[-1][0]
+        return [prefix for _, prefix, origin in rows if origin != os.getpid()]
+
+
+class Cache:
+    """Cache front-end: get/set/TTL/atomic add plus invalidation broadcast
+
+    With a shared backend, reads are served from process memory for up to
+    CACHE_LOCAL_TTL seconds, and invalidations issued by other workers are
+    picked up within CACHE_INVALIDATION_POLL seconds.
+    """
+
+    def __init__(self, backend, local_ttl: float = CACHE_LOCAL_TTL, poll_interval: float = CACHE_INVALIDATION_POLL):
+        self.backend = backend
+        self.local_ttl = local_ttl if backend.shared else 0
+        self.poll_interval = poll_interval
+        self._local: Dict[str, Tuple[Any, float]] = {}
+        self._listeners: List[Tuple[str, Callable[[str], None]]] = []
+        self._next_poll = 0.0
+        self._next_sweep = 0.0
+
+    def subscribe(self, prefix: str, callback: Callable[[str], None]):
+        """Call `callback(prefix)` whenever keys overlapping `prefix` are invalidated, by any worker"""
+        self._listeners.append((prefix, callback))
+
+    def _apply_invalidation(self, prefix: str):
+        if prefix.startswith(EXACT_MARKER):
+            key = prefix[len(EXACT_MARKER):]
+            self._local.pop(key, None)
+            matches = lambda listen_prefix: key.startswith(listen_prefix)
+        else:
+            for key in [key for key in self._local if key.startswith(prefix)]:
+                self._local.pop(key, None)
+            matches = lambda listen_prefix: listen_prefix.startswith(prefix) or prefix.startswith(listen_prefix)
+        for listen_prefix, callback in self._listeners:
+            if matches(listen_prefix):
+                try:
+                    callback(prefix)
+                except Exception:
+                    logger.exception("Cache invalidation listener failed")
+
+    def poll(self):
+        """Apply invalidations broadcast by other workers (rate-limited)"""
+        now = time.monotonic()
+        if now < self._next_poll:
+            return
+        self._next_poll = now + self.poll_interval
+        if self._local and now >= self._next_sweep:
+            # Drop local copies that expired without being read again
+            self._next_sweep = now + self.local_ttl
+            for key in [key for key, (_, expires_at) in list(self._local.items()) if expires_at <= now]:
+                self._local.pop(key, None)
+        try:
+            for prefix in self.backend.poll_invalidations():
+                self._apply_invalidation(prefix)
+        except sqlite3.Error:
+            logger.exception("Cache invalidation poll failed")
+
+    def get(self, key: str, default: Any = None, local: bool = True) -> Any:
+        """Look up `key`; pass local=False for values that must not be served stale"""
+        self.poll()
+        if self.local_ttl and local:
+            entry = self._local.get(key)
+            if entry is not None:
+                if entry[1] > time.monotonic():
+                    return entry[0]
+                self._local.pop(key, None)
+        value = self.backend.get(key)
+        if value is None:
+            return default
+        if self.local_ttl:
+            self._local[key] = (value, time.monotonic() + self.local_ttl)
+        return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        self.poll()
+        self.backend.set(key, value, ttl)
+        if self.local_ttl:
+            self._local[key] = (value, time.monotonic() + min(self.local_ttl, ttl or self.local_ttl))
+
+    def add(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        """Set `key` only if absent (or expired); True if this call stored it"""
+        return self.backend.add(key, value, ttl)
+
+    def delete(self, key: str):
+        self._local.pop(key, None)
+        self.backend.delete(key)
+
+    def invalidate(self, prefix: str):
+        """Drop every key starting with `prefix` here and in all other workers"""
+        self.backend.invalidate(prefix)
+        self._apply_invalidation(prefix)
+
+    def invalidate_keys(self, keys: Iterable[str]):
+        """Drop exactly these keys here and in all other workers"""
+        keys = list(keys)
+        if not keys:
+            return
+        self.backend.invalidate_keys(keys)
+        for key in keys:
+            self._apply_invalidation(EXACT_MARKER + key)
+
+    def reset_local(self):
+        """Forget process-local copies (e.g. after fork)"""
+        self._local.clear()
+
+
+def create_cache(backend: str = CACHE_BACKEND) -> Cache:
+    """Build the configured cache"""
+    if backend == "memory":
+        return Cache(MemoryCache())
+    if backend == "sqlite":
+        return Cache(SQLiteCache())
+    raise ValueError(f"Unknown CACHE_BACKEND: {backend}")
+
+
+# Global cache instance
+cache = create_cache()
@@ -0,0 +1,119 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from dotenv import load_dotenv
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+
+from app.utils.static_assets import ENCODING_SUFFIXES, compress, negotiate_encoding
+
+load_dotenv()
+
+# Configuration
+API_COMPRESSION_MIN_SIZE = int(os.getenv("API_COMPRESSION_MIN_SIZE", "1024"))  # Smaller bodies are sent as-is
+API_COMPRESSION_PATHS = tuple(os.getenv("API_COMPRESSION_PATHS", "/api/").split(","))  # Path prefixes to compress
+API_COMPRESSION_CACHE_ENTRIES = int(os.getenv("API_COMPRESSION_CACHE_ENTRIES", "256"))  # Compressed bodies kept
+API_COMPRESSION_THREAD_SIZE = 256 * 1024  # Bodies at least this large are compressed off the event loop
+
+COMPRESSIBLE_TYPES = ("application/json", "text/")
+
+
+class CompressedBodyCache:
+    """LRU of compressed bodies keyed by a digest of the uncompressed body
+
+    Identical payloads (cached listings, repeated lookups) are compressed once.
+    """
+
+    def __init__(self, max_entries: int = API_COMPRESSION_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[bytes, str], bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple[bytes, str]) -> Optional[bytes]:
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+            return body
+
+    def put(self, key: Tuple[bytes, str], body: bytes):
+        with self._lock:
+            self._entries[key] = body
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class ApiCompressionMiddleware:
+    """Compress dynamic API responses with brotli or gzip, at latency-friendly levels"""
+
+    def __init__(self, app, minimum_size: int = API_COMPRESSION_MIN_SIZE, paths: tuple = API_COMPRESSION_PATHS):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.paths = paths
+        self.cache = CompressedBodyCache()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.paths):
+            await self.app(scope, receive, send)
+            return
+
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""), ENCODING_SUFFIXES)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        passthrough = False
+        body_parts = []
+
+        async def send_compressed(message):
+            nonlocal start_message, passthrough
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                content_type = headers.get("content-type", "")
+                if "content-encoding" in headers or not content_type.startswith(COMPRESSIBLE_TYPES):
+                    passthrough = True
+                    await send(message)
+                else:
+                    # Hold the start message until the whole body is known
+                    start_message = message
+                return
+            if passthrough or message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body_parts.append(message.get("body", b""))
+            if message.get("more_body", False):
+                return
+            await self.send_response(start_message, b"".join(body_parts), encoding, send)
+
+        await self.app(scope, receive, send_compressed)
+
+    async def compressed_body(self, body: bytes, encoding: str) -> bytes:
+        key = (hashlib.blake2b(body, digest_size=16).digest(), encoding)
+        compressed = self.cache.get(key)
+        if compressed is None:
+            if len(body) >= API_COMPRESSION_THREAD_SIZE:
+                compressed = await run_in_threadpool(compress, body, encoding, True)
+            else:
+                compressed = compress(body, encoding, fast=True)
+            self.cache.put(key, compressed)
+        return compressed
+
+    async def send_response(self, start_message: dict, body: bytes, encoding: str, send):
+        headers = MutableHeaders(raw=start_message["headers"])
+        headers.add_vary_header("Accept-Encoding")
+
+        if len(body) >= self.minimum_size:
+            compressed = await self.compressed_body(body, encoding)
+            if len(compressed) < len(body):
+                body = compressed
+                headers["Content-Encoding"] = encoding
+                headers["Content-Length"] = str(len(body))
+
+        await send({**start_message, "headers": headers.raw})
+        await send({"type": "http.response.body", "body": body})
@@ -1,12 +1,152 @@
+import io
 import os
 import hashlib
-from typing import Optional
+import logging
+import tempfile
+import threading
+from typing import Dict, Iterable, Optional, Set
 from pathlib import Path
 
+from app.utils.cache import EXACT_MARKER, cache
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+IMAGE_CACHE_RESCAN_INTERVAL = float(os.getenv("IMAGE_CACHE_RESCAN_INTERVAL", "300"))  # Seconds between reconciling scans, 0 = never
+GENERATED_IMAGE_REENCODE = os.getenv("GENERATED_IMAGE_REENCODE", "").lower()  # "" stores model bytes as-is; "png" re-encodes (optimized)
+
+def needs_reencode(mime_type: str, reencode: str = GENERATED_IMAGE_REENCODE) -> bool:
+    """True if write_image_file() will decode and re-encode these bytes (CPU work), not just write them"""
+    return bool(reencode) or mime_type != "image/png"
+
+def write_image_file(data: bytes, target, mime_type: str = "image/png", reencode: str = GENERATED_IMAGE_REENCODE) -> int:
+    """Write image bytes to `target` atomically and return the size written
+
+    The bytes go to a temp file in the target's directory and are renamed into
+    place, so readers never see a partial image. They are only decoded and
+    re-encoded when conversion is configured or the model returned a non-PNG.
+    """
+    if needs_reencode(mime_type, reencode):
+        from PIL import Image
+        buffer = io.BytesIO()
+        with Image.open(io.BytesIO(data)) as image:
+            image.save(buffer, format="PNG", optimize=True)
+        data = buffer.getvalue()
+
+    target = Path(target)
+    fd, temp_path = tempfile.mkstemp(dir=target.parent, prefix=f".{target.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.write(data)
+        os.replace(temp_path, target)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return len(data)
+
 class ImageCache:
-    def __init__(self, cache_dir: str = "static/generated/cache"):
+    """Generated images on disk, with an in-memory index of which ones exist
+
+    Presence checks are set lookups instead of stat() calls. The index is built
+    by one directory scan, updated on every write and clear, kept in step with
+    other processes through the shared cache's invalidation log, and
+    reconciled by a periodic rescan.
+    """
+    
+    # Invalidation events ("generated:<cache key>") announce writes and deletions
+    EVENT_PREFIX = "generated:"
+    
+    def __init__(self, cache_dir: str = "static/generated/cache", rescan_interval: float = IMAGE_CACHE_RESCAN_INTERVAL):
         self.cache_dir = Path(cache_dir)
         self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.rescan_interval = rescan_interval
+        self._present: Set[str] = set()
+        self._scanned = False
+        self._lock = threading.Lock()
+        self._scan_lock = threading.Lock()  # One scan at a time
+        # Writes and deletions recorded while a scan is listing the directory, replayed onto its result
+        self._changed_during_scan: Optional[Dict[str, bool]] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        cache.subscribe(self.EVENT_PREFIX, self._on_event)
+    
+    def scan(self) -> int:
+        """Rebuild the presence index from one directory listing; returns the image count"""
+        with self._scan_lock:
+            with self._lock:
+                self._changed_during_scan = {}
+            try:
+                with os.scandir(self.cache_dir) as entries:
+                    # Dot-files are in-progress writes (see write_image_file)
+                    present = {
+                        entry.name[:-len(".png")] for entry in entries
+                        if entry.name.endswith(".png") and not entry.name.startswith(".")
+                    }
+            except BaseException:
+                with self._lock:
+                    self._changed_during_scan = None
+                raise
+            with self._lock:
+                changed, self._changed_during_scan = self._changed_during_scan, None
+                # The listing may predate a write or deletion made while it ran; those win
+                for cache_key, exists in changed.items():
+                    if exists:
+                        present.add(cache_key)
+                    else:
+                        present.discard(cache_key)
+                self._present = present
+                self._scanned = True
+        return len(present)
+    
+    def _set_present(self, cache_keys: Iterable[str], exists: bool):
+        with self._lock:
+            for cache_key in cache_keys:
+                if exists:
+                    self._present.add(cache_key)
+                else:
+                    self._present.discard(cache_key)
+                if self._changed_during_scan is not None:
+                    self._changed_during_scan[cache_key] = exists
+    
+    def _on_event(self, prefix: str):
+        """Apply another process's write or deletion (or a broad invalidation) to the index"""
+        if not prefix.startswith(EXACT_MARKER):
+            # Anything broader than one image: rescan on next use
+            self._scanned = False
+            return
+        cache_key = prefix[len(EXACT_MARKER) + len(self.EVENT_PREFIX):]
+        self._set_present([cache_key], (self.cache_dir / f"{cache_key}.png").exists())
+    
+    def _announce(self, cache_keys: Iterable[str]):
+        cache.invalidate_keys([f"{self.EVENT_PREFIX}{cache_key}" for cache_key in cache_keys])
+    
+    def mark_cached(self, user_id: int, product_id: int):
+        """Record an image written into the cache directory, here and in every other process"""
+        cache_key = self.get_cache_key(user_id, product_id)
+        self._set_present([cache_key], True)
+        self._announce([cache_key])
+    
+    def start_reconciler(self):
+        """Start the thread that periodically rescans, correcting files changed behind the index's back"""
+        if self.rescan_interval <= 0 or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._reconcile, name="image-cache-rescan", daemon=True)
+        self._thread.start()
+    
+    def stop_reconciler(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+    
+    def _reconcile(self):
+        while not self._stop.wait(self.rescan_interval):
+            try:
+                self.scan()
+            except OSError:
+                logger.exception("Image cache rescan failed")
     
     def get_cache_key(self, user_id: int, product_id: int) -> str:
         """Generate a unique cache key for user-product combination"""
@@ -23,9 +163,11 @@ class ImageCache:
         return f"/static/generated/cache/{cache_key}.png"
     
     def is_cached(self, user_id: int, product_id: int) -> bool:
-        """Check if a generated image exists in cache"""
-        cache_path = self.get_cache_path(user_id, product_id)
-        return cache_path.exists()
+        """Check if a generated image exists in cache (an index lookup, no filesystem access)"""
+        cache.poll()
+        if not self._scanned:
+            self.scan()
+        return self.get_cache_key(user_id, product_id) in self._present
     
     def get_cached_image_url(self, user_id: int, product_id: int) -> Optional[str]:
         """Get cached image URL if it exists, None otherwise"""
@@ -33,27 +175,28 @@ class ImageCache:
             return self.get_cache_url(user_id, product_id)
         return None
     
-    def save_generated_image(self, user_id: int, product_id: int, image_path: str) -> str:
-        """Save a generated image to cache and return the cache URL"""
-        cache_path = self.get_cache_path(user_id, product_id)
-        
-        # Copy the generated image to cache location
-        import shutil
-        shutil.copy2(image_path, cache_path)
-        
+    def write_generated_image(self, user_id: int, product_id: int, data: bytes, mime_type: str = "image/png") -> str:
+        """Write generated image bytes straight into the cache and return the cache URL (blocking)"""
+        write_image_file(data, self.get_cache_path(user_id, product_id), mime_type)
+        self.mark_cached(user_id, product_id)
         return self.get_cache_url(user_id, product_id)
     
+    def _clear(self, pattern: str):
+        removed = []
+        for cache_file in self.cache_dir.glob(pattern):
+            cache_file.unlink(missing_ok=True)
+            removed.append(cache_file.stem)
+        self._set_present(removed, False)
+        if removed:
+            self._announce(removed)
+    
     def clear_user_cache(self, user_id: int):
         """Clear all cached images for a specific user"""
-        pattern = f"user_{user_id}_product_*.png"
-        for cache_file in self.cache_dir.glob(pattern):
-            cache_file.unlink()
+        self._clear(f"user_{user_id}_product_*.png")
     
     def clear_product_cache(self, product_id: int):
         """Clear all cached images for a specific product"""
-        pattern = f"user_*_product_{product_id}.png"
-        for cache_file in self.cache_dir.glob(pattern):
-            cache_file.unlink()
+        self._clear(f"user_*_product_{product_id}.png")
 
 # Global cache instance
 image_cache = ImageCache()
@@ -0,0 +1,58 @@
+import base64
+import io
+import os
+from pathlib import Path
+from typing import Dict, Optional
+
+from dotenv import load_dotenv
+from PIL import Image, features
+
+load_dotenv()
+
+# Configuration
+IMAGE_PLACEHOLDER_SIZE = int(os.getenv("IMAGE_PLACEHOLDER_SIZE", "12"))  # Longest side of the placeholder, in pixels
+
+# WebP keeps a 12px placeholder around 120 base64 characters; PNG is ~3x larger
+_PLACEHOLDER_FORMAT = ("WEBP", "image/webp") if features.check("webp") else ("PNG", "image/png")
+
+
+def local_image_path(image_url: str) -> Optional[Path]:
+    """Filesystem path of a /static/... or ./static/... product image, None for remote images"""
+    if image_url.startswith(("http://", "https://", "//")):
+        return None
+    return Path(os.getcwd()) / image_url.lstrip("./")
+
+
+def image_metadata(path, placeholder_size: int = IMAGE_PLACEHOLDER_SIZE) -> Dict[str, object]:
+    """Width, height and a tiny data-URI placeholder for an image file
+
+    Browsers upscale the placeholder smoothly, which reads as a blurred preview
+    while the full image downloads.
+    """
+    with Image.open(path) as image:
+        width, height = image.size
+        # JPEG draft mode decodes at a reduced scale, skipping most of the work
+        image.draft("RGB", (placeholder_size * 4, placeholder_size * 4))
+        preview = image.convert("RGB")
+    preview.thumbnail((placeholder_size, placeholder_size))
+
+    image_format, mime_type = _PLACEHOLDER_FORMAT
+    buffer = io.BytesIO()
+    preview.save(buffer, format=image_format, quality=40, optimize=True)
+    encoded = base64.b64encode(buffer.getvalue()).decode("ascii")
+    return {
+        "image_width": width,
+        "image_height": height,
+        "image_placeholder": f"data:{mime_type};base64,{encoded}",
+    }
+
+
+def product_image_metadata(image_url: str) -> Dict[str, object]:
+    """image_metadata() for a product's image URL; empty if the file is remote, missing or unreadable"""
+    path = local_image_path(image_url)
+    if path is None or not path.is_file():
+        return {}
+    try:
+        return image_metadata(path)
+    except OSError:
+        return {}
@@ -0,0 +1,168 @@
+import cProfile
+import hmac
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+from fastapi import FastAPI, Request
+from fastapi.concurrency import run_in_threadpool
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Configuration - everything is off unless explicitly enabled
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))  # Fraction of requests, 0.0 - 1.0
+PROFILE_HEADER = "X-Profile"
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")  # The header is ignored unless this is set and matches
+SAMPLER_INTERVAL = float(os.getenv("PROFILE_SAMPLER_INTERVAL", "0"))  # Seconds between stack samples, 0 disables
+SAMPLER_FLUSH_SECONDS = float(os.getenv("PROFILE_SAMPLER_FLUSH_SECONDS", "60"))
+
+
+def _profile_filename(label: str, suffix: str) -> Path:
+    """Build a `<timestamp>_<label>.<suffix>` path inside the profile directory"""
+    profile_dir = Path(PROFILE_DIR)
+    profile_dir.mkdir(parents=True, exist_ok=True)
+    safe_label = re.sub(r"[^A-Za-z0-9_.-]+", "_", label).strip("_") or "root"
+    timestamp = datetime.now().strftime("%Y%m%dT%H%M%S%f")
+    return profile_dir / f"{timestamp}_{safe_label}.{suffix}"
+
+
+class RequestProfiler:
+    """Capture cProfile traces for requests selected by header or sample rate"""
+
+    def __init__(self, sample_rate: float = PROFILE_SAMPLE_RATE, token: Optional[str] = PROFILE_TOKEN):
+        self.sample_rate = sample_rate
+        self.token = token
+        # Only one cProfile can be active per interpreter, so captures are serialized
+        self._lock = threading.Lock()
+
+    def requested(self, request: Request) -> bool:
+        """True if the request carries the profile header with the configured token"""
+        header = request.headers.get(PROFILE_HEADER)
+        return bool(self.token) and header is not None and hmac.compare_digest(header, self.token)
+
+    def should_profile(self, request: Request) -> bool:
+        """Decide whether this request gets profiled"""
+        return self.requested(request) or (self.sample_rate > 0 and random.random() < self.sample_rate)
+
+    async def __call__(self, request: Request, call_next):
+        if not self.should_profile(request) or not self._lock.acquire(blocking=False):
+            return await call_next(request)
+
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        try:
+            # Other coroutines interleaving on the loop thread are captured too;
+            # under load, treat the trace as a sample of the worker, not the route alone.
+            profiler.enable()
+            try:
+                response = await call_next(request)
+            finally:
+                profiler.disable()
+        finally:
+            self._lock.release()
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        route = request.scope.get("route")
+        label = f"{request.method}_{route.path if route else request.url.path}"
+        path = _profile_filename(label, "prof")
+        await run_in_threadpool(profiler.dump_stats, path)
+        logger.info("Request profile written", extra={"profile_path": str(path), "duration_ms": round(elapsed_ms, 2)})
+        # Only a caller holding the token learns where its profile went
+        if self.requested(request):
+            response.headers["X-Profile-File"] = path.name
+        return response
+
+
+class StackSampler:
+    """Periodically sample all thread stacks and write collapsed (flamegraph) stacks"""
+
+    def __init__(self, interval: float = SAMPLER_INTERVAL, flush_seconds: float = SAMPLER_FLUSH_SECONDS):
+        self.interval = interval
+        self.flush_seconds = flush_seconds
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """Start the sampler thread if sampling is configured"""
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+        logger.info("Stack sampler started", extra={"interval": self.interval})
+
+    def stop(self):
+        """Stop sampling and write whatever has been collected"""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.flush()
+
+    def sample(self):
+        """Record the current stack of every other thread"""
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        own_ident = threading.get_ident()
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            frames = [f"{f.name} ({os.path.basename(f.filename)}:{f.lineno})" for f in traceback.extract_stack(frame)]
+            self.stacks[";".join([names.get(ident, str(ident))] + frames)] += 1
+
+    def flush(self):
+        """Write collected stacks to a `.folded` file and reset the counters"""
+        if not self.stacks:
+            return
+        path = _profile_filename("sampler", "folded")
+        with open(path, "w", encoding="utf-8") as file:
+            for stack, count in self.stacks.most_common():
+                file.write(f"{stack} {count}\n")
+        self.stacks.clear()
+        logger.info("Stack samples written", extra={"profile_path": str(path)})
+
+    def _run(self):
+        last_flush = time.monotonic()
+        while not self._stop.wait(self.interval):
+            self.sample()
+            if time.monotonic() - last_flush >= self.flush_seconds:
+                self.flush()
+                last_flush = time.monotonic()
+
+
+# Global sampler instance
+stack_sampler = StackSampler()
+
+
+def install_profiling(app: FastAPI):
+    """Attach the request profiler when profiling is enabled"""
+    if not PROFILING_ENABLED:
+        return
+    app.middleware("http")(RequestProfiler())
+    logger.info("Request profiling enabled", extra={"sample_rate": PROFILE_SAMPLE_RATE, "profile_dir": PROFILE_DIR})
+
+
+def start_sampler():
+    """Start the background stack sampler when profiling is enabled"""
+    if PROFILING_ENABLED:
+        stack_sampler.start()
+
+
+def stop_sampler():
+    """Stop the stack sampler and flush its samples"""
+    stack_sampler.stop()
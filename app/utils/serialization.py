@@ -0,0 +1,58 @@
+import operator
+from typing import Any, Callable, Iterable, List, Type
+
+import orjson
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+from app.schemas import ProductResponse, UserResponse
+
+
+def dumps(content: Any) -> bytes:
+    """Encode plain data (dicts, lists, str, numbers, datetimes) to compact JSON bytes"""
+    return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON response encoded with orjson
+
+    Returning one from an endpoint also skips FastAPI's response_model
+    validation, so content must already match the declared schema; build it
+    with the serializers below.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def make_serializer(schema: Type[BaseModel]) -> Callable[[Any], dict]:
+    """Build a function turning an ORM object, Row or dict into the schema's fields
+
+    Values are copied as-is, so the source must already hold the schema's types.
+    """
+    fields = tuple(schema.model_fields)
+    get_attributes = operator.attrgetter(*fields)
+    get_items = operator.itemgetter(*fields)
+
+    def serialize(obj: Any) -> dict:
+        values = get_items(obj) if isinstance(obj, dict) else get_attributes(obj)
+        return dict(zip(fields, values))
+
+    return serialize
+
+
+serialize_product = make_serializer(ProductResponse)
+serialize_user = make_serializer(UserResponse)
+
+# Field order of product records; Core selects list columns in this order
+PRODUCT_FIELDS = tuple(ProductResponse.model_fields)
+
+
+def serialize_products(rows: Iterable[Any]) -> List[dict]:
+    """Serialize a sequence of products for a ProductResponse list"""
+    return [serialize_product(row) for row in rows]
+
+
+def product_rows_to_dicts(rows: Iterable[tuple], fields: tuple = PRODUCT_FIELDS) -> List[dict]:
+    """Zip plain result tuples (columns in `fields` order) into product dicts"""
+    return [dict(zip(fields, row)) for row in rows]
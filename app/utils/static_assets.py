@@ -0,0 +1,253 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Optional
+
+import brotli
+from fastapi import Request
+from fastapi.responses import FileResponse, Response
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+
+from app.utils.serialization import dumps
+
+# Configuration
+STATIC_DIR = "static"
+DIST_DIR = "static/dist"  # Build output: content-hashed and precompressed assets
+MANIFEST_PATH = os.path.join(DIST_DIR, "manifest.json")
+TEMPLATE_DIR = "templates"
+
+GENERATED_CACHE_DIR = "static/generated/cache"  # Personalized images, overwritten when regenerated
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"  # Always revalidate with ETag / Last-Modified
+MEDIA_CACHE_CONTROL = "public, max-age=86400"  # Product photos and uploads
+GENERATED_CACHE_CONTROL = "public, max-age=300"  # Short, since a regenerated image keeps its URL
+
+# Unhashed files of these types change with deploys and must always be revalidated
+REVALIDATE_MEDIA_TYPES = {"text/html", "text/css", "text/javascript", "application/javascript", "application/json"}
+
+# Preferred order when the client accepts several encodings
+ENCODING_SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+_STATIC_URL_PATTERN = re.compile(r"/static/[^\"'\s)]+")
+
+# Templates mark where server-provided bootstrap data goes with this comment
+INITIAL_DATA_MARKER = "<!-- INITIAL_DATA -->"
+
+
+def load_manifest(manifest_path: str = MANIFEST_PATH) -> Dict[str, str]:
+    """Load the `source -> hashed` asset manifest written by build_assets.py"""
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+
+def negotiate_encoding(accept_encoding: str, available: Iterable[str]) -> Optional[str]:
+    """Pick the best available content-coding the client accepts"""
+    accepted = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+
+    for encoding in ENCODING_SUFFIXES:
+        if encoding in available and accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+def compress(content: bytes, encoding: str, fast: bool = False) -> bytes:
+    """Compress a body with the given content-coding (maximum ratio unless `fast`)"""
+    if encoding == "br":
+        return brotli.compress(content, quality=5 if fast else 11)
+    return gzip.compress(content, compresslevel=6 if fast else 9, mtime=0)
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """StaticFiles that serves .br/.gz siblings and long-lived caching for hashed assets"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Index precompressed siblings once so serving never probes the filesystem for them
+        self.precompressed: Dict[str, set] = {}
+        if self.directory and os.path.isdir(self.directory):
+            suffix_encodings = {suffix: encoding for encoding, suffix in ENCODING_SUFFIXES.items()}
+            for root, _, files in os.walk(self.directory):
+                for name in files:
+                    base, suffix = os.path.splitext(name)
+                    if suffix in suffix_encodings:
+                        full_path = os.path.realpath(os.path.join(root, base))
+                        self.precompressed.setdefault(full_path, set()).add(suffix_encodings[suffix])
+        self.dist_dir = os.path.realpath(DIST_DIR)
+        self.generated_dir = os.path.realpath(GENERATED_CACHE_DIR)
+
+    def cache_control(self, full_path: str) -> str:
+        """Cache-Control for a file: immutable when hashed, revalidated for pages and code, cached for media"""
+        if full_path.startswith(self.dist_dir + os.sep):
+            return IMMUTABLE_CACHE_CONTROL
+        if mimetypes.guess_type(full_path)[0] in REVALIDATE_MEDIA_TYPES:
+            return REVALIDATE_CACHE_CONTROL
+        if full_path.startswith(self.generated_dir + os.sep):
+            return GENERATED_CACHE_CONTROL
+        return MEDIA_CACHE_CONTROL
+
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200) -> Response:
+        request_headers = Headers(scope=scope)
+        full_path = str(full_path)
+
+        headers = {"Cache-Control": self.cache_control(full_path)}
+
+        variants = self.precompressed.get(full_path, ())
+        encoding = negotiate_encoding(request_headers.get("accept-encoding", ""), variants) if variants else None
+        if variants:
+            headers["Vary"] = "Accept-Encoding"
+
+        if encoding:
+            compressed_path = full_path + ENCODING_SUFFIXES[encoding]
+            headers["Content-Encoding"] = encoding
+            response = FileResponse(
+                compressed_path,
+                status_code=status_code,
+                headers=headers,
+                media_type=mimetypes.guess_type(full_path)[0] or "application/octet-stream",
+                stat_result=os.stat(compressed_path),
+            )
+        else:
+            response = FileResponse(full_path, status_code=status_code, headers=headers, stat_result=stat_result)
+
+        if self.is_not_modified(response.headers, request_headers):
+            return Response(status_code=304, headers={
+                key: value for key, value in response.headers.items()
+                if key in ("cache-control", "etag", "last-modified", "vary", "content-location")
+            })
+        return response
+
+
+class TemplatePages:
+    """Serve HTML templates with hashed asset URLs, compressed bodies and ETag revalidation"""
+
+    def __init__(self, template_dir: str = TEMPLATE_DIR, manifest_path: str = MANIFEST_PATH):
+        self.template_dir = Path(template_dir)
+        self.manifest_path = manifest_path
+        self._asset_urls: Optional[Dict[str, str]] = None
+        self._templates: Dict[str, tuple] = {}
+        self._pages: Dict[str, dict] = {}
+        # Rendered pages with the data version each was built from
+        self._rendered: Dict[tuple, tuple] = {}
+
+    @property
+    def asset_urls(self) -> Dict[str, str]:
+        """Source URL -> hashed URL, read from the manifest on first use"""
+        if self._asset_urls is None:
+            manifest = load_manifest(self.manifest_path)
+            self._asset_urls = {f"/static/{source}": f"/static/dist/{hashed}" for source, hashed in manifest.items()}
+        return self._asset_urls
+
+    def asset_url(self, url: str) -> str:
+        """Map a source asset URL to its content-hashed URL when one was built"""
+        return self.asset_urls.get(url, url)
+
+    def rewrite_asset_urls(self, html: str) -> str:
+        """Point every built asset referenced in the page at its hashed URL"""
+        if not self.asset_urls:
+            return html
+        return _STATIC_URL_PATTERN.sub(lambda match: self.asset_url(match.group(0)), html)
+
+    def build_page(self, content: bytes, last_modified: float, fast: bool = False) -> dict:
+        """Precompute the headers and encoded bodies for a page"""
+        return {
+            "etag": f'"{hashlib.md5(content).hexdigest()}"',
+            "last_modified": formatdate(last_modified, usegmt=True),
+            "bodies": {
+                None: content,
+                **{encoding: compress(content, encoding, fast) for encoding in ENCODING_SUFFIXES},
+            },
+        }
+
+    def get_template(self, name: str) -> tuple:
+        """Template text with hashed asset URLs, and its modification time"""
+        template = self._templates.get(name)
+        if template is None:
+            path = self.template_dir / name
+            template = (self.rewrite_asset_urls(path.read_text(encoding="utf-8")), path.stat().st_mtime)
+            self._templates[name] = template
+        return template
+
+    def get_page(self, name: str) -> dict:
+        """Load, rewrite and compress a template once per process"""
+        page = self._pages.get(name)
+        if page is None:
+            html, mtime = self.get_template(name)
+            page = self.build_page(html.replace(INITIAL_DATA_MARKER, "").encode("utf-8"), mtime)
+            self._pages[name] = page
+        return page
+
+    def render(self, name: str, key, version: str, updated_at: float, data_factory: Callable[[], dict]) -> dict:
+        """Render a template with an inlined JSON bootstrap payload, cached until its data version changes"""
+        version_page = self._rendered.get((name, key))
+        page = version_page[1] if version_page is not None and version_page[0] == version else None
+        if page is None:
+            html, mtime = self.get_template(name)
+            # Escape "<" so product text can never close the script element
+            payload = dumps(data_factory()).decode("utf-8").replace("<", "\\u003c")
+            script = f'<script id="initial-data" type="application/json">{payload}</script>'
+            page = self.build_page(
+                html.replace(INITIAL_DATA_MARKER, script).encode("utf-8"),
+                max(mtime, updated_at),
+                fast=True,
+            )
+            self._rendered[(name, key)] = (version, page)
+        return page
+
+    def is_not_modified(self, request: Request, etag: str, last_modified: str) -> bool:
+        """Evaluate If-None-Match, falling back to If-Modified-Since"""
+        if if_none_match := request.headers.get("if-none-match"):
+            return if_none_match.strip() == "*" or etag in [
+                tag.strip().removeprefix("W/") for tag in if_none_match.split(",")
+            ]
+        if if_modified_since := request.headers.get("if-modified-since"):
+            try:
+                return parsedate_to_datetime(if_modified_since) >= parsedate_to_datetime(last_modified)
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def page_response(self, request: Request, page: dict) -> Response:
+        """Answer with 304, or the best encoded body for the client"""
+        encoding = negotiate_encoding(request.headers.get("accept-encoding", ""), page["bodies"])
+        # Each encoding is its own representation, so it gets its own strong ETag
+        etag = page["etag"] if encoding is None else f'{page["etag"][:-1]}-{encoding}"'
+        headers = {
+            "ETag": etag,
+            "Last-Modified": page["last_modified"],
+            "Cache-Control": REVALIDATE_CACHE_CONTROL,
+            "Vary": "Accept-Encoding",
+        }
+
+        if self.is_not_modified(request, etag, page["last_modified"]):
+            return Response(status_code=304, headers=headers)
+
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return Response(page["bodies"][encoding], media_type="text/html", headers=headers)
+
+    def response(self, request: Request, name: str) -> Response:
+        """Serve a static template"""
+        return self.page_response(request, self.get_page(name))
+
+
+# Global page cache instance
+template_pages = TemplatePages()
@@ -0,0 +1,73 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, List, Optional
+
+# The trace of the generation job running in this context; copied into executor
+# threads along with the request ID, so model-side stages land on the same trace
+_current_trace: ContextVar[Optional["Trace"]] = ContextVar("generation_trace", default=None)
+
+
+class Trace:
+    """Timed stages (spans) of one generation job, with byte sizes and other attributes"""
+
+    def __init__(self, **attributes):
+        self.attributes = attributes
+        self.spans: List[Dict[str, object]] = []
+        self.status = "started"
+        self.created_at = datetime.utcnow()
+        self._started = time.perf_counter()
+        self.total_ms: Optional[float] = None
+        self._token = None
+
+    def _offset_ms(self, moment: float) -> float:
+        return round((moment - self._started) * 1000, 1)
+
+    def mark(self, name: str, since: float, **attributes) -> dict:
+        """Record a span that began at perf_counter() value `since` and ends now"""
+        now = time.perf_counter()
+        record = {"name": name, "start_ms": self._offset_ms(since), "duration_ms": round((now - since) * 1000, 1)}
+        record.update(attributes)
+        self.spans.append(record)
+        return record
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """Time the block; the yielded dict takes attributes learned inside it (e.g. bytes)"""
+        started = time.perf_counter()
+        extra = dict(attributes)
+        try:
+            yield extra
+        finally:
+            self.mark(name, started, **extra)
+
+    def finish(self, status: str):
+        self.status = status
+        self.total_ms = self._offset_ms(time.perf_counter())
+        # Later work in the same context (e.g. the next background task) is not part of this job
+        if self._token is not None:
+            _current_trace.reset(self._token)
+            self._token = None
+
+
+def start_trace(**attributes) -> Trace:
+    """Begin tracing the job running in the current context"""
+    trace = Trace(**attributes)
+    trace._token = _current_trace.set(trace)
+    return trace
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Record a stage on the current job's trace; outside a traced job it only runs the block"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield dict(attributes)
+        return
+    with trace.span(name, **attributes) as extra:
+        yield extra
@@ -0,0 +1,287 @@
+"""
+Benchmark the catalog, auth and personalization flows in-process.
+
+Usage:
+    python -m benchmarks.run --products 2000 --users 50 --output results.json
+    python -m benchmarks.run --compare results.json   # fail on p99 regressions
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List
+
+SCENARIOS = [
+    "products_list",
+    "products_list_men",
+    "product_detail",
+    "login",
+    "signup",
+    "personalized_status",
+    "personalized_trigger",
+]
+
+
+class StubPart:
+    """Mimics a google.genai response part carrying an inline PNG"""
+
+    def __init__(self, png_bytes: bytes):
+        self.inline_data = type("InlineData", (), {"data": png_bytes, "mime_type": "image/png"})()
+
+
+class StubResponse:
+    def __init__(self, png_bytes: bytes):
+        self.parts = [StubPart(png_bytes)]
+
+
+def make_stub_generator(delay: float) -> Callable:
+    """Build a drop-in replacement for `generate_product_image` that never calls the API"""
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (512, 768), (240, 220, 60)).save(buffer, format="PNG")
+    png_bytes = buffer.getvalue()
+
+    def generate_product_image(product_image_path: str, user_image_path: str, *args, **kwargs):
+        time.sleep(delay)
+        return StubResponse(png_bytes)
+
+    return generate_product_image
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def summarize(latencies: List[float], errors: int, duration: float) -> dict:
+    """Reduce raw latencies (seconds) to throughput and percentile stats"""
+    ordered = sorted(latencies)
+
+    def percentile(q: float) -> float:
+        if not ordered:
+            return 0.0
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 3)
+
+    return {
+        "requests": len(ordered),
+        "errors": errors,
+        "duration_s": round(duration, 4),
+        "throughput_rps": round(len(ordered) / duration, 2) if duration else 0.0,
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3) if ordered else 0.0,
+        "p50_ms": percentile(0.50),
+        "p90_ms": percentile(0.90),
+        "p99_ms": percentile(0.99),
+        "max_ms": round(ordered[-1] * 1000, 3) if ordered else 0.0,
+    }
+
+
+async def run_scenario(call: Callable[[int], Awaitable], requests: int, concurrency: int, warmup: int) -> dict:
+    """Issue `requests` calls with at most `concurrency` in flight and time each one"""
+    for i in range(warmup):
+        await call(-1 - i)
+
+    latencies: List[float] = []
+    errors = 0
+    counter = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            start = time.perf_counter()
+            response = await call(i)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - start)
+
+
+def setup_environment(workdir: str, args) -> dict:
+    """Point the app at a scratch database, seed it and stub out image generation"""
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ["CACHE_SQLITE_PATH"] = os.path.join(workdir, "cache.sqlite3")
+    os.environ["CATALOG_SNAPSHOT_PATH"] = os.path.join(workdir, "catalog_snapshot.bin")
+    os.environ["RELATED_INDEX_PATH"] = os.path.join(workdir, "related_index.bin")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    from benchmarks.seed import write_catalog, seed_users
+
+    data_path = os.path.join(workdir, "data.json")
+    write_catalog(data_path, args.products, args.seed)
+
+    from load_products import load_products_from_json
+    with contextlib.redirect_stdout(io.StringIO()):
+        load_products_from_json(data_path)
+
+    from app.database import SessionLocal
+    db = SessionLocal()
+    try:
+        credentials = seed_users(db, args.users)
+    finally:
+        db.close()
+
+    import main
+    from app.utils import background_tasks
+    from app.utils.image_cache import image_cache
+
+    background_tasks.generate_product_image = make_stub_generator(args.generation_delay)
+    image_cache.cache_dir = Path(workdir) / "cache"
+    image_cache.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    return {"app": main.app, "credentials": credentials}
+
+
+async def run_benchmarks(args) -> Dict[str, dict]:
+    import httpx
+
+    with tempfile.TemporaryDirectory(prefix="banana-bench-") as workdir:
+        env = setup_environment(workdir, args)
+        credentials = env["credentials"]
+        rng = random.Random(args.seed)
+        transport = httpx.ASGITransport(app=env["app"])
+
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            # Log every synthetic user in once to get tokens for the personalization flow
+            tokens = []
+            for cred in credentials:
+                response = await client.post("/api/auth/login", json=cred)
+                tokens.append(response.json()["access_token"])
+
+            def auth_header(i: int) -> dict:
+                return {"Authorization": f"Bearer {tokens[i % len(tokens)]}"}
+
+            def random_product_id() -> int:
+                return rng.randint(1, args.products)
+
+            # Pairs stay fresh (uncached) as long as requests < products * users
+            trigger_pairs = itertools.cycle(
+                (user, product)
+                for product in range(1, args.products + 1)
+                for user in range(len(tokens))
+            )
+
+            calls = {
+                "products_list": lambda i: client.get("/api/products/"),
+                "products_list_men": lambda i: client.get("/api/products/", params={"gender": "men"}),
+                "product_detail": lambda i: client.get(f"/api/products/{random_product_id()}"),
+                "login": lambda i: client.post("/api/auth/login", json=credentials[i % len(credentials)]),
+                "signup": lambda i: client.post("/api/auth/signup", data={
+                    "name": "Bench Signup",
+                    "email": f"signup{i}_{rng.random()}@example.com",
+                    "password": "BenchPass1!",
+                    "country": "Egypt",
+                    "gender": "female",
+                }),
+                "personalized_status": lambda i: client.get(
+                    f"/api/products/{random_product_id()}/personalized-image", headers=auth_header(i)
+                ),
+                "personalized_trigger": lambda i: _trigger(client, trigger_pairs, tokens),
+            }
+
+            results = {}
+            for name in args.scenarios:
+                results[name] = await run_scenario(calls[name], args.requests, args.concurrency, args.warmup)
+                print(f"{name:22s} {results[name]['throughput_rps']:>9.1f} req/s  "
+                      f"p50 {results[name]['p50_ms']:>8.2f} ms  p99 {results[name]['p99_ms']:>8.2f} ms  "
+                      f"errors {results[name]['errors']}", file=sys.stderr)
+
+        # Let triggered generations finish before their working directory is removed
+        from app.utils.background_tasks import image_task_manager
+        await image_task_manager.drain()
+        return results
+
+
+async def _trigger(client, pairs, tokens):
+    """Trigger generation for a fresh (user, product) pair so every call misses the cache"""
+    user, product = next(pairs)
+    return await client.post(
+        f"/api/products/{product}/generate-personalized-image",
+        headers={"Authorization": f"Bearer {tokens[user]}"},
+    )
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> bool:
+    """Print per-scenario deltas against a baseline; return False on regressions"""
+    ok = True
+    print(f"\nComparison against {baseline['meta'].get('commit')} (threshold {threshold:.0%}):", file=sys.stderr)
+    for name, stats in current["results"].items():
+        base = baseline["results"].get(name)
+        if not base or not base["p99_ms"]:
+            continue
+        p99_delta = stats["p99_ms"] / base["p99_ms"] - 1
+        rps_delta = stats["throughput_rps"] / base["throughput_rps"] - 1 if base["throughput_rps"] else 0.0
+        regressed = p99_delta > threshold
+        ok = ok and not regressed
+        print(f"  {name:22s} p99 {p99_delta:+7.1%}  throughput {rps_delta:+7.1%}"
+              f"{'  REGRESSION' if regressed else ''}", file=sys.stderr)
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Banana Shop benchmark suite")
+    parser.add_argument("--products", type=int, default=1000, help="Synthetic catalog size")
+    parser.add_argument("--users", type=int, default=20, help="Synthetic user count")
+    parser.add_argument("--requests", type=int, default=300, help="Measured requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=10, help="Requests in flight per scenario")
+    parser.add_argument("--warmup", type=int, default=10, help="Unmeasured requests before each scenario")
+    parser.add_argument("--generation-delay", type=float, default=0.0,
+                        help="Seconds the stubbed generator sleeps per image")
+    parser.add_argument("--scenarios", type=lambda s: s.split(","), default=SCENARIOS,
+                        help=f"Comma-separated subset of: {','.join(SCENARIOS)}")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write JSON results to this file (default: stdout)")
+    parser.add_argument("--compare", help="Baseline results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed p99 regression, e.g. 0.2 = 20%%")
+    args = parser.parse_args()
+
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    results = asyncio.run(run_benchmarks(args))
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "products": args.products,
+            "users": args.users,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "generation_delay": args.generation_delay,
+        },
+        "results": results,
+    }
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as file:
+            baseline = json.load(file)
+        if not compare(report, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import json
+import random
+from typing import Dict, List
+
+# Real product photos to point synthetic products at, so generation finds files on disk
+PRODUCT_IMAGES = [
+    "./static/products/00706663717-e1.jpg",
+    "./static/products/04302340500-e1.jpg",
+    "./static/products/05643063800-e1.jpg",
+    "./static/products/05788203528-e1.jpg",
+    "./static/products/05854001711-e1.jpg",
+    "./static/products/06861337800-e1.jpg",
+    "./static/products/07446307330-e1.jpg",
+    "./static/products/07446320600-e1.jpg",
+    "./static/products/08491421800-e1.jpg",
+]
+USER_IMAGE = "/static/images/placeholder.jpg"
+
+CATEGORIES = ["BLAZER", "CAMISA", "CAZADORA", "SOBRECAMISA", "PANTALON", "VESTIDO"]
+FITS = ["RELAXED FIT", "SLIM FIT", "REGULAR FIT", "OVERSIZED", "LIMITED EDITION"]
+ITEMS = ["SHIRT", "BLAZER", "JACKET", "OVERSHIRT", "TROUSERS", "DRESS"]
+FEATURES = ["WITH POCKETS", "FLOWING", "TEXTURED", "DOUBLE-BREASTED", "LINEN BLEND", "CROPPED"]
+SIZE_RUNS = [["S", "M", "L", "XL"], ["XS", "S", "M", "L", "XL", "XXL"], ["46", "48", "50", "52", "54"]]
+COLORS = ["Black", "White", "Ecru", "Dark olive", "Navy blue", "Sand", "Grey marl", "Brown"]
+DESCRIPTION = (
+    "{fit} {item} made of a cotton and linen blend fabric. Featuring a lapel collar, "
+    "long sleeves with buttoned cuffs, chest patch pockets and side pockets at the hip, "
+    "and a button-up front. Synthetic benchmark product #{n}."
+)
+
+BENCH_PASSWORD = "BenchPass1!"
+
+
+def generate_catalog(size: int, seed: int = 42) -> Dict[str, dict]:
+    """Generate a synthetic catalog in the data.json schema (keyed by SKU)"""
+    rng = random.Random(seed)
+    catalog = {}
+    for n in range(size):
+        fit, item = rng.choice(FITS), rng.choice(ITEMS)
+        sku = f"{90000000000000 + n}"
+        catalog[sku] = {
+            "name": f"{fit} {item} {rng.choice(FEATURES)}",
+            "price": f"{rng.randint(9, 99)},{rng.choice(['490', '990', '290'])}",
+            "category": rng.choice(CATEGORIES),
+            "image": rng.choice(PRODUCT_IMAGES),
+            "description": DESCRIPTION.format(fit=fit.lower(), item=item.lower(), n=n),
+            "sizes": rng.choice(SIZE_RUNS),
+            "colors": rng.sample(COLORS, rng.randint(1, 3)),
+            "gender": rng.choice(["men", "women"]),
+        }
+    return catalog
+
+
+def write_catalog(path: str, size: int, seed: int = 42):
+    """Write a synthetic catalog file loadable by `load_products.py`"""
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(generate_catalog(size, seed), file)
+
+
+def seed_users(db, count: int) -> List[dict]:
+    """Insert synthetic users sharing one password and return their credentials"""
+    from app.models import User
+    from app.utils.auth import hash_password
+
+    # One bcrypt hash for everyone - seeding should not take minutes
+    hashed_password = hash_password(BENCH_PASSWORD)
+    users = [
+        User(
+            name=f"Bench User {n}",
+            email=f"bench{n}@example.com",
+            password=hashed_password,
+            country="Egypt",
+            gender="male",
+            image=USER_IMAGE,
+        )
+        for n in range(count)
+    ]
+    db.add_all(users)
+    db.commit()
+    return [{"email": user.email, "password": BENCH_PASSWORD} for user in users]
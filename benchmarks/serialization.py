@@ -0,0 +1,91 @@
+"""
+Compare the cost of encoding product lists through response_model validation
+versus the prebuilt serializers and fast encoder in app.utils.serialization.
+
+Usage:
+    python -m benchmarks.serialization --sizes 100,1000,10000 --output serialization.json
+"""
+import argparse
+import json
+import sys
+import time
+from typing import Callable, Dict, List
+
+from benchmarks.seed import generate_catalog
+
+
+def build_rows(size: int, seed: int) -> List:
+    """Transient Product objects shaped exactly like rows loaded from the database"""
+    from app.models import Product
+
+    return [
+        Product(id=n, sku=sku, is_active=True, **info)
+        for n, (sku, info) in enumerate(generate_catalog(size, seed).items(), start=1)
+    ]
+
+
+def time_call(call: Callable[[], bytes], repeat: int) -> dict:
+    """Best and mean wall time of `call` over `repeat` runs"""
+    timings = []
+    body = b""
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = call()
+        timings.append(time.perf_counter() - start)
+    return {
+        "best_ms": round(min(timings) * 1000, 3),
+        "mean_ms": round(sum(timings) / len(timings) * 1000, 3),
+        "bytes": len(body),
+    }
+
+
+def run(sizes: List[int], repeat: int, seed: int) -> Dict[str, dict]:
+    from typing import List as ListType
+    from fastapi.responses import JSONResponse
+    from pydantic import TypeAdapter
+    from app.schemas import ProductResponse
+    from app.utils.serialization import FastJSONResponse, serialize_products
+
+    adapter = TypeAdapter(ListType[ProductResponse])
+
+    def response_model_path(rows):
+        # What FastAPI does for `response_model=List[ProductResponse]` on ORM objects
+        validated = adapter.validate_python(rows, from_attributes=True)
+        return JSONResponse(adapter.dump_python(validated, mode="json")).body
+
+    def fast_path(rows):
+        return FastJSONResponse(serialize_products(rows)).body
+
+    results = {}
+    for size in sizes:
+        rows = build_rows(size, seed)
+        baseline = time_call(lambda: response_model_path(rows), repeat)
+        fast = time_call(lambda: fast_path(rows), repeat)
+        results[str(size)] = {
+            "response_model": baseline,
+            "fast": fast,
+            "speedup": round(baseline["best_ms"] / fast["best_ms"], 2) if fast["best_ms"] else None,
+        }
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="100,1000,10000", help="Comma-separated list sizes")
+    parser.add_argument("--repeat", type=int, default=20, help="Timed runs per size and path")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write JSON results to this file (default: stdout)")
+    args = parser.parse_args(argv)
+
+    results = run([int(size) for size in args.sizes.split(",")], args.repeat, args.seed)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(text)
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
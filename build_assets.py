@@ -0,0 +1,48 @@
+import hashlib
+import json
+import shutil
+from pathlib import Path
+from app.utils.static_assets import STATIC_DIR, DIST_DIR, MANIFEST_PATH, ENCODING_SUFFIXES, compress
+
+# Text assets worth fingerprinting and precompressing (images are already compressed)
+ASSET_GLOBS = ["css/*.css", "js/*.js", "images/*.svg"]
+
+def build_assets():
+    """Write content-hashed copies of static assets plus gzip/brotli siblings and a manifest"""
+    print("Building static assets...")
+
+    # Start from a clean output directory so stale hashes don't pile up
+    shutil.rmtree(DIST_DIR, ignore_errors=True)
+
+    static_dir = Path(STATIC_DIR)
+    manifest = {}
+
+    for pattern in ASSET_GLOBS:
+        for source in sorted(static_dir.glob(pattern)):
+            content = source.read_bytes()
+            digest = hashlib.sha256(content).hexdigest()[:10]
+
+            relative = source.relative_to(static_dir)
+            hashed = relative.with_name(f"{source.stem}.{digest}{source.suffix}")
+            target = Path(DIST_DIR) / hashed
+            target.parent.mkdir(parents=True, exist_ok=True)
+            target.write_bytes(content)
+
+            sizes = [f"{len(content)} B"]
+            for encoding in ENCODING_SUFFIXES:
+                compressed = compress(content, encoding)
+                # Only keep a variant if it actually saves bytes
+                if len(compressed) < len(content):
+                    Path(f"{target}{ENCODING_SUFFIXES[encoding]}").write_bytes(compressed)
+                    sizes.append(f"{encoding} {len(compressed)} B")
+
+            manifest[relative.as_posix()] = hashed.as_posix()
+            print(f"  {relative.as_posix()} -> dist/{hashed.as_posix()} ({', '.join(sizes)})")
+
+    with open(MANIFEST_PATH, "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=2)
+
+    print(f"Wrote {len(manifest)} assets and {MANIFEST_PATH}")
+
+if __name__ == "__main__":
+    build_assets()
@@ -1,8 +1,13 @@
 import json
 import os
+import sys
 from sqlalchemy.orm import sessionmaker
 from app.database import engine, create_tables
 from app.models import Product, Base
+from app.services import related_service
+from app.services.catalog_service import CATALOG_SNAPSHOT_PATH, write_catalog_snapshot
+from app.utils.cache import cache
+from app.utils.image_metadata import product_image_metadata
 
 def reset_database():
     """Completely reset the database by dropping and recreating all tables"""
@@ -16,8 +21,8 @@ def reset_database():
     Base.metadata.create_all(bind=engine)
     print("All tables recreated.")
 
-def load_products_from_json():
-    """Load products from data.json file into the database"""
+def load_products_from_json(data_path: str = "data.json"):
+    """Load products from a data.json-style file into the database"""
     
     # Reset the database completely
     reset_database()
@@ -28,43 +33,65 @@ def load_products_from_json():
     
     try:
         # Check if data.json exists
-        if not os.path.exists("data.json"):
-            print("Error: data.json file not found!")
+        if not os.path.exists(data_path):
+            print(f"Error: {data_path} file not found!")
             return
             
         # Read the JSON file
-        with open("data.json", "r", encoding="utf-8") as file:
+        with open(data_path, "r", encoding="utf-8") as file:
             products_data = json.load(file)
         
-        print(f"Found {len(products_data)} products in data.json")
+        print(f"Found {len(products_data)} products in {data_path}")
         
         # No need to clear existing products since we reset the database
         
+        # Dimensions and placeholder per distinct image file
+        image_metadata = {}
+        
         # Add products to database
         for sku, product_info in products_data.items():
             # Determine gender based on product name and category (basic logic)
             # You can adjust this logic based on your data
-            gender = "men"  # Default to men for now, as the sample data appears to be men's clothing
+            # Entries may set "gender" explicitly; otherwise default to men,
+            # as the sample data appears to be men's clothing
+            gender = product_info.get("gender", "men")
             
-            # If you want to add women's products, you can modify this logic
-            # For now, we'll create all as men's products since the data seems to be men's fashion
+            image = product_info["image"]
+            if image not in image_metadata:
+                image_metadata[image] = product_image_metadata(image)
             
             product = Product(
                 sku=sku,
                 name=product_info["name"],
                 price=product_info["price"],
                 category=product_info["category"],
-                image=product_info["image"],
+                image=image,
+                **image_metadata[image],
                 description=product_info["description"],
                 sizes=product_info["sizes"],
                 colors=product_info["colors"],
-                gender=gender
+                gender=gender,
+                additional_data=product_info.get("additional_data")
             )
             
             db.add(product)
         
         db.commit()
         print(f"Successfully loaded {len(products_data)} products into the database")
+        missing = [image for image, metadata in image_metadata.items() if not metadata]
+        if missing:
+            print(f"Note: no dimensions or placeholder for {len(missing)} image(s) not found locally")
+
+        # Snapshot the catalog so workers start warm
+        write_catalog_snapshot()
+        print(f"Wrote catalog snapshot to {CATALOG_SNAPSHOT_PATH}")
+
+        # Precompute "related products" for the new catalog
+        related_service.build_related_index()
+        print(f"Built related-products index at {related_service.RELATED_INDEX_PATH}")
+
+        # Users and products were recreated, so nothing cached about them is valid
+        cache.invalidate("")
         
         # Print some stats
         men_count = db.query(Product).filter(Product.gender == "men").count()
@@ -79,4 +106,4 @@ def load_products_from_json():
         db.close()
 
 if __name__ == "__main__":
-    load_products_from_json()
+    load_products_from_json(sys.argv[1] if len(sys.argv) > 1 else "data.json")
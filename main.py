@@ -1,62 +1,121 @@
-from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+import time
+
+# Measured from the very first import so startup logs show the full cost
+_import_started = time.perf_counter()
+
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from app.routers import auth, products
+from app.routers import admin, auth, pages, products
 from app.database import create_tables
+from app.services.analytics_service import analytics
+from app.services.catalog_service import catalog_cache
+from app.utils.background_tasks import image_task_manager
+from app.utils.compression import ApiCompressionMiddleware
+from app.utils.image_cache import image_cache
+from app.utils.logging_config import setup_logging, request_id_var
+from app.utils.profiling import install_profiling, start_sampler, stop_sampler
+from app.utils.static_assets import PrecompressedStaticFiles
+import logging
 import os
+import uuid
+
+logger = logging.getLogger(__name__)
+
+_import_ms = (time.perf_counter() - _import_started) * 1000
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Initialize shared state on startup; drain generation jobs on shutdown"""
+    started = time.perf_counter()
+
+    # Create database tables
+    create_tables()
+
+    # Start from the catalog snapshot file unless a pre-fork parent already mapped it
+    if catalog_cache.version is None:
+        catalog_cache.load_snapshot()
+
+    # Index which personalized images exist, so status polls never touch the disk
+    image_cache.scan()
+    image_cache.start_reconciler()
+    analytics.start()
+
+    # Pick up generation jobs a previous process had to abandon
+    resumed = image_task_manager.resume()
+    start_sampler()
+
+    logger.info("Startup complete", extra={
+        "import_ms": round(_import_ms, 1),
+        "startup_ms": round((time.perf_counter() - started) * 1000, 1),
+        "resumed_generations": resumed,
+    })
+
+    yield
+
+    # Let in-flight generations finish so their API calls aren't wasted; save the rest
+    unfinished = await image_task_manager.drain()
+    image_task_manager.checkpoint(unfinished)
+    stop_sampler()
+    image_cache.stop_reconciler()
+    # Write counts still held in memory
+    analytics.stop()
+    logger.info("Shutdown complete", extra={"unfinished_generations": len(unfinished)})
+
+def create_app() -> FastAPI:
+    """Build the FastAPI application; heavy resources are set up in `lifespan`"""
+    # Configure structured, queue-backed logging before anything else logs
+    setup_logging()
+
+    app = FastAPI(
+        title="Banana Fashion Store",
+        description="A minimalistic e-commerce website for fashion",
+        version="1.0.0",
+        lifespan=lifespan
+    )
+
+    # Add CORS middleware
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],  # In production, specify actual origins
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+
+    # Compress JSON API responses (pages and static files ship precompressed)
+    app.add_middleware(ApiCompressionMiddleware)
+
+    # Opt-in request profiling (see PROFILING_* settings)
+    install_profiling(app)
+
+    # Tag each request (and the background jobs it starts) with a correlation ID
+    @app.middleware("http")
+    async def assign_request_id(request: Request, call_next):
+        request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+        token = request_id_var.set(request_id)
+        try:
+            response = await call_next(request)
+        finally:
+            request_id_var.reset(token)
+        response.headers["X-Request-ID"] = request_id
+        return response
+
+    # Include routers
+    app.include_router(auth.router)
+    app.include_router(products.router)
+    app.include_router(pages.router)
+    app.include_router(admin.router)
+    app.include_router(admin.traces_router)
+
+    # Mount static files (serves precompressed variants and hashed assets built by build_assets.py)
+    app.mount("/static", PrecompressedStaticFiles(directory="static"), name="static")
+
+    return app
 
-# Create FastAPI app
-app = FastAPI(
-    title="Banana Fashion Store",
-    description="A minimalistic e-commerce website for fashion",
-    version="1.0.0"
-)
-
-# Add CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # In production, specify actual origins
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-# Create database tables
-create_tables()
-
-# Include routers
-app.include_router(auth.router)
-app.include_router(products.router)
-
-# Mount static files
-app.mount("/static", StaticFiles(directory="static"), name="static")
-
-# Serve the main HTML file
-@app.get("/")
-async def read_index():
-    return FileResponse('templates/index.html')
-
-@app.get("/login")
-async def read_login():
-    return FileResponse('templates/login.html')
-
-@app.get("/signup")
-async def read_signup():
-    return FileResponse('templates/signup.html')
-
-@app.get("/men")
-async def read_men():
-    return FileResponse('templates/men.html')
-
-@app.get("/women")
-async def read_women():
-    return FileResponse('templates/women.html')
-
-@app.get("/product/{product_id}")
-async def read_product(product_id: int):
-    return FileResponse('templates/product.html')
+app = create_app()
 
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # See serve.py for multi-worker settings (WEB_WORKERS, WORKER_MAX_REQUESTS, ...)
+    from serve import serve
+    serve()
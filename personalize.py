@@ -0,0 +1,296 @@
+"""
+Precompute personalized images for many users x products offline.
+
+Pairs already in the image cache (or finished in an earlier run) are skipped, so an
+interrupted run picks up where it stopped when started again with the same checkpoint.
+
+Usage:
+    python personalize.py --gender men --concurrency 4 --workers 4
+    python personalize.py --users 1,2,3 --products 10,11 --checkpoint campaign.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import select
+
+from app.database import SessionLocal
+from app.models import Product, User
+from app.services import genai_service
+from app.services.analytics_service import analytics
+from app.utils.background_tasks import GENERATION_CONCURRENCY, image_task_manager
+from app.utils.image_cache import image_cache, needs_reencode, write_image_file
+
+# Configuration
+DEFAULT_CHECKPOINT = "personalize_checkpoint.json"
+MAX_INPUT_SIDE = 1024  # Inputs are downscaled to this before upload; larger adds latency, not quality
+CHECKPOINT_EVERY = 10  # Completed pairs between checkpoint writes
+
+# User gender -> product section, for --match-gender
+SECTION_FOR_GENDER = {"male": "men", "female": "women"}
+
+
+def resolve_path(image_path: str) -> str:
+    """Turn a stored /static/... or ./static/... path into a filesystem path"""
+    if image_path.startswith("/static/"):
+        image_path = image_path[1:]
+    return os.path.join(os.getcwd(), image_path)
+
+
+def prepare_input(source: str, target: str, max_side: int = MAX_INPUT_SIDE) -> str:
+    """Downscale and normalize an input image once, in a worker process"""
+    from PIL import Image
+
+    with Image.open(source) as image:
+        image = image.convert("RGB")
+        image.thumbnail((max_side, max_side))
+        image.save(target, format="PNG")
+    return target
+
+
+class Checkpoint:
+    """Finished and failed pairs, persisted so an interrupted run can resume"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.done = set()
+        self.failed: Dict[str, str] = {}
+        self._pending_writes = 0
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as file:
+                data = json.load(file)
+            self.done = set(data.get("done", []))
+            self.failed = data.get("failed", {})
+
+    def record(self, key: str, error: Optional[str] = None):
+        if error is None:
+            self.done.add(key)
+            self.failed.pop(key, None)
+        else:
+            self.failed[key] = error
+        self._pending_writes += 1
+        if self._pending_writes >= CHECKPOINT_EVERY:
+            self.save()
+
+    def save(self):
+        # Write-then-rename so a crash never leaves a truncated checkpoint
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump({"done": sorted(self.done), "failed": self.failed}, file)
+        os.replace(temp_path, self.path)
+        self._pending_writes = 0
+
+
+def pair_key(user_id: int, product_id: int) -> str:
+    return f"{user_id}_{product_id}"
+
+
+def enumerate_pairs(args) -> Iterator[Tuple[dict, dict]]:
+    """Target (user, product) pairs for this run, before skipping finished ones
+
+    Pairs are produced lazily: users x products can be far larger than either list.
+    """
+    db = SessionLocal()
+    try:
+        user_query = select(User.id, User.gender, User.image).where(User.is_active == True, User.image.is_not(None))
+        if args.users:
+            user_query = user_query.where(User.id.in_(args.users))
+        product_query = select(Product.id, Product.gender, Product.image).where(Product.is_active == True)
+        if args.products:
+            product_query = product_query.where(Product.id.in_(args.products))
+        if args.gender:
+            product_query = product_query.where(Product.gender == args.gender)
+        users = [row._asdict() for row in db.execute(user_query.order_by(User.id))]
+        products = [row._asdict() for row in db.execute(product_query.order_by(Product.id))]
+    finally:
+        db.close()
+
+    pairs = (
+        (user, product)
+        for user in users
+        for product in products
+        if not args.match_gender or SECTION_FOR_GENDER.get(user["gender"]) == product["gender"]
+    )
+    yield from islice(pairs, args.limit) if args.limit else pairs
+
+
+def pending_pairs(args, checkpoint: Checkpoint, stats: Optional["Stats"] = None) -> Iterator[Tuple[dict, dict]]:
+    """Target pairs not cached or finished in an earlier run, counted into `stats` if given"""
+    for user, product in enumerate_pairs(args):
+        if stats:
+            stats.counts["targets"] += 1
+        key = pair_key(user["id"], product["id"])
+        if image_cache.is_cached(user["id"], product["id"]):
+            if stats:
+                stats.counts["cached"] += 1
+        elif key in checkpoint.done or key in checkpoint.failed:
+            if stats:
+                stats.counts["checkpointed"] += 1
+        else:
+            yield user, product
+
+
+class Stats:
+    """Counters and generation latencies for the final report"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.counts = {"targets": 0, "cached": 0, "checkpointed": 0, "in_progress": 0, "succeeded": 0, "failed": 0}
+        self.latencies: List[float] = []
+        self.bytes_written = 0
+
+    def report(self) -> dict:
+        elapsed = time.monotonic() - self.started
+        ordered = sorted(self.latencies)
+        return {
+            **self.counts,
+            "elapsed_s": round(elapsed, 1),
+            "images_per_min": round(self.counts["succeeded"] / elapsed * 60, 2) if elapsed else 0.0,
+            "mean_generation_s": round(sum(ordered) / len(ordered), 2) if ordered else 0.0,
+            "p95_generation_s": round(ordered[int(0.95 * (len(ordered) - 1))], 2) if ordered else 0.0,
+            "mb_written": round(self.bytes_written / 1e6, 2),
+        }
+
+
+async def run(args) -> dict:
+    stats = Stats()
+    checkpoint = Checkpoint(args.checkpoint)
+    if args.retry_failed:
+        checkpoint.failed.clear()
+
+    # Count first without keeping the pairs; they are enumerated again as workers need them
+    todo = sum(1 for _ in pending_pairs(args, checkpoint, stats))
+
+    print(f"{todo} of {stats.counts['targets']} pairs to generate "
+          f"({stats.counts['cached']} cached, {stats.counts['checkpointed']} done or failed in earlier runs)")
+    if args.dry_run or not todo:
+        return stats.report()
+
+    loop = asyncio.get_running_loop()
+    # Model calls are I/O-bound and use threads; image decoding/encoding is CPU-bound and uses processes
+    model_pool = ThreadPoolExecutor(max_workers=args.concurrency, thread_name_prefix="personalize")
+    process_pool = ProcessPoolExecutor(max_workers=args.workers)
+    input_dir = tempfile.mkdtemp(prefix="personalize-inputs-")
+    prepared: Dict[str, asyncio.Future] = {}
+    # A bounded queue keeps only a few pairs ahead of the workers, however many there are in total
+    queue: asyncio.Queue = asyncio.Queue(maxsize=args.concurrency)
+    stopping = asyncio.Event()
+
+    def prepare(image_path: str) -> asyncio.Future:
+        # Each distinct input image is normalized once, however many pairs use it
+        if image_path not in prepared:
+            target = os.path.join(input_dir, f"{len(prepared)}.png")
+            prepared[image_path] = loop.run_in_executor(process_pool, prepare_input, resolve_path(image_path), target)
+        return prepared[image_path]
+
+    async def generate(user: dict, product: dict):
+        user_id, product_id = user["id"], product["id"]
+        key = pair_key(user_id, product_id)
+        if stopping.is_set():
+            return
+        # Share the in-flight claim with the web workers so neither duplicates the other
+        if not image_task_manager.start_generation(user_id, product_id):
+            stats.counts["in_progress"] += 1
+            return
+        try:
+            user_input, product_input = await asyncio.gather(prepare(user["image"]), prepare(product["image"]))
+            started = time.monotonic()
+            response = await asyncio.wait_for(
+                loop.run_in_executor(model_pool, genai_service.generate_product_image, product_input, user_input),
+                timeout=args.timeout,
+            )
+            stats.latencies.append(time.monotonic() - started)
+            image = genai_service.extract_image(response)
+            if image is None:
+                raise ValueError("No image in model response")
+            target = str(image_cache.get_cache_path(user_id, product_id))
+            # Re-encoding (GENERATED_IMAGE_REENCODE or a non-PNG response) is CPU work for the process
+            # pool; a plain write is I/O, so a thread does it without shipping the bytes to another process
+            data, mime_type = image
+            executor = process_pool if needs_reencode(mime_type) else None
+            stats.bytes_written += await loop.run_in_executor(executor, write_image_file, data, target, mime_type)
+            # Web workers learn of the new image through the shared cache's invalidation log
+            image_cache.mark_cached(user_id, product_id)
+            analytics.record_generation(user_id, product_id)
+            stats.counts["succeeded"] += 1
+            checkpoint.record(key)
+        except Exception as e:
+            stats.counts["failed"] += 1
+            checkpoint.record(key, error=f"{type(e).__name__}: {e}")
+            print(f"  failed user {user_id} product {product_id}: {type(e).__name__}: {e}")
+        finally:
+            image_task_manager.finish_generation(user_id, product_id)
+
+        finished = stats.counts["succeeded"] + stats.counts["failed"]
+        if finished % args.progress_every == 0:
+            report = stats.report()
+            print(f"  {finished}/{todo} finished, {report['images_per_min']} images/min, "
+                  f"{stats.counts['failed']} failed")
+
+    async def produce():
+        for pair in pending_pairs(args, checkpoint):
+            if stopping.is_set():
+                break
+            await queue.put(pair)
+        for _ in range(args.concurrency):
+            await queue.put(None)  # One stop marker per worker
+
+    async def work():
+        while (pair := await queue.get()) is not None:
+            await generate(*pair)
+
+    # Stop taking new pairs on Ctrl-C / SIGTERM; in-flight pairs finish and the checkpoint is kept
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stopping.set)
+
+    try:
+        await asyncio.gather(produce(), *(work() for _ in range(args.concurrency)))
+    finally:
+        checkpoint.save()
+        analytics.flush()
+        process_pool.shutdown(cancel_futures=True)
+        model_pool.shutdown(wait=False, cancel_futures=True)
+        shutil.rmtree(input_dir, ignore_errors=True)
+
+    if stopping.is_set():
+        print(f"Interrupted; progress saved to {args.checkpoint}, run again to resume")
+    return stats.report()
+
+
+def parse_ids(value: str) -> List[int]:
+    return [int(item) for item in value.split(",") if item.strip()]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=parse_ids, help="Comma-separated user IDs (default: all with a profile image)")
+    parser.add_argument("--products", type=parse_ids, help="Comma-separated product IDs (default: all active)")
+    parser.add_argument("--gender", choices=["men", "women"], help="Only products from this section")
+    parser.add_argument("--match-gender", action=argparse.BooleanOptionalAction, default=True,
+                        help="Pair users only with their own section's products")
+    parser.add_argument("--limit", type=int, default=0, help="Process at most this many pairs")
+    parser.add_argument("--concurrency", type=int, default=GENERATION_CONCURRENCY, help="Model calls in flight")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Processes for image pre/post-processing")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Seconds before a model call is abandoned")
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT, help="Progress file used to resume")
+    parser.add_argument("--retry-failed", action="store_true", help="Retry pairs that failed in earlier runs")
+    parser.add_argument("--progress-every", type=int, default=25, help="Print progress every N pairs")
+    parser.add_argument("--dry-run", action="store_true", help="Only count the pairs that would be generated")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run(args))
+    print(json.dumps(report, indent=2))
+    return 1 if report["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,161 @@
+"""
+Production launcher: one pre-forked uvicorn worker per core sharing a listening socket.
+
+Usage:
+    WEB_WORKERS=4 WORKER_MAX_REQUESTS=10000 python serve.py
+"""
+import logging
+import os
+import random
+import signal
+import socket
+import sys
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger("serve")
+
+# Configuration
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8000"))
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "1"))  # 0 = one per CPU core
+WORKER_MAX_REQUESTS = int(os.getenv("WORKER_MAX_REQUESTS", "0"))  # Recycle a worker after N requests, 0 = never
+WORKER_MAX_REQUESTS_JITTER = int(os.getenv("WORKER_MAX_REQUESTS_JITTER", "0"))  # Spread recycling over time
+WORKER_MIN_UPTIME = float(os.getenv("WORKER_MIN_UPTIME", "5"))  # A worker exiting sooner counts as a failed start
+WORKER_MAX_QUICK_EXITS = int(os.getenv("WORKER_MAX_QUICK_EXITS", "5"))  # Failed starts in a row before giving up
+WORKER_RESPAWN_MAX_DELAY = 30.0  # Cap on the doubling delay before replacing a worker that failed to start
+
+
+def preload():
+    """Import the app and load shared read-only state once, before forking"""
+    from main import app
+    from app.database import create_tables, engine
+    from app.services.catalog_service import catalog_cache
+    from app.services.related_service import related_index
+    from app.utils.static_assets import template_pages
+
+    create_tables()
+    # Loaded state stays shared between workers: the mapped catalog snapshot through
+    # the page cache (the database is read only if there is none), pages copy-on-write
+    if not catalog_cache.load_snapshot():
+        catalog_cache.get_version()
+    related_index.load()
+    for name in ("index.html", "login.html", "signup.html", "men.html", "women.html", "product.html"):
+        template_pages.get_page(name)
+
+    # SQLite connections must not cross fork(); each worker opens its own
+    engine.dispose()
+    return app
+
+
+def run_worker(app, sock: socket.socket, workers: int):
+    """Serve requests in a forked child until recycled or told to stop"""
+    import uvicorn
+    from app.utils.admission import admission, GENERATION_CONCURRENCY
+
+    # Split the host-wide generation budget between workers
+    admission.concurrency = max(1, GENERATION_CONCURRENCY // workers)
+
+    limit = None
+    if WORKER_MAX_REQUESTS > 0:
+        limit = WORKER_MAX_REQUESTS + random.randint(0, WORKER_MAX_REQUESTS_JITTER)
+
+    config = uvicorn.Config(app, limit_max_requests=limit)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def serve() -> int:
+    """Run single-process uvicorn, or a pre-fork supervisor when WEB_WORKERS > 1; returns the exit code"""
+    workers = WEB_WORKERS or os.cpu_count() or 1
+
+    if workers <= 1:
+        import uvicorn
+        from main import app
+        uvicorn.run(app, host=HOST, port=PORT, limit_max_requests=WORKER_MAX_REQUESTS or None)
+        return 0
+
+    app = preload()
+
+    sock = socket.socket(socket.AF_INET6 if ":" in HOST else socket.AF_INET)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((HOST, PORT))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    children = {}  # pid -> monotonic start time
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            # Child: restore default signal handling and let uvicorn install its own
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            code = 0
+            try:
+                run_worker(app, sock, workers)
+            except BaseException:
+                logger.exception("Worker failed")
+                code = 1
+            finally:
+                from app.utils.logging_config import shutdown_logging
+                shutdown_logging()
+                os._exit(code)
+        children[pid] = time.monotonic()
+        logger.info("Worker started", extra={"pid": pid})
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    logger.info("Starting workers", extra={"workers": workers, "host": HOST, "port": PORT})
+    for _ in range(workers):
+        spawn()
+
+    # Replace workers that exit (recycled after WORKER_MAX_REQUESTS, or crashed) until asked to stop.
+    # Workers that die right after starting (bad config, port, database) are replaced with a growing
+    # delay, and after WORKER_MAX_QUICK_EXITS in a row the launcher gives up instead of fork-looping.
+    quick_exits = 0
+    exit_code = 0
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        uptime = time.monotonic() - children.pop(pid, time.monotonic())
+        if stopping:
+            continue
+
+        quick_exits = quick_exits + 1 if uptime < WORKER_MIN_UPTIME else 0
+        if quick_exits >= WORKER_MAX_QUICK_EXITS:
+            logger.error("Workers keep failing to start, shutting down",
+                         extra={"pid": pid, "status": status, "quick_exits": quick_exits})
+            exit_code = 1
+            stop(None, None)
+            continue
+
+        delay = min(WORKER_RESPAWN_MAX_DELAY, 0.5 * 2 ** (quick_exits - 1)) if quick_exits else 0
+        logger.info("Worker exited, replacing",
+                    extra={"pid": pid, "status": status, "uptime_s": round(uptime, 1), "delay_s": delay})
+        if delay:
+            time.sleep(delay)
+        if not stopping:
+            spawn()
+
+    sock.close()
+    logger.info("All workers stopped")
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(serve())
@@ -11,8 +11,24 @@ class Auth {
         localStorage.setItem('accessToken', token);
     }
     
+    static getRefreshToken() {
+        return localStorage.getItem('refreshToken');
+    }
+    
+    static setSession(response) {
+        // Store everything login, signup and refresh return
+        this.setToken(response.access_token);
+        if (response.refresh_token) {
+            localStorage.setItem('refreshToken', response.refresh_token);
+        }
+        if (response.user) {
+            this.setUser(response.user);
+        }
+    }
+    
     static removeToken() {
         localStorage.removeItem('accessToken');
+        localStorage.removeItem('refreshToken');
         localStorage.removeItem('currentUser');
     }
     
@@ -26,7 +42,86 @@ class Auth {
     }
     
     static isLoggedIn() {
-        return !!this.getToken();
+        return !!(this.getToken() || this.getRefreshToken());
+    }
+    
+    static tokenExpiresSoon(token, marginSeconds = 60) {
+        try {
+            const payload = JSON.parse(atob(token.split('.')[1]));
+            return payload.exp * 1000 - Date.now() < marginSeconds * 1000;
+        } catch (error) {
+            return true;
+        }
+    }
+    
+    static refresh() {
+        // One refresh at a time: concurrent callers share the same request
+        if (!this.refreshPromise) {
+            this.refreshPromise = this.doRefresh().finally(() => {
+                this.refreshPromise = null;
+            });
+        }
+        return this.refreshPromise;
+    }
+    
+    static async doRefresh() {
+        const refreshToken = this.getRefreshToken();
+        if (!refreshToken) return null;
+        
+        try {
+            const response = await fetch(`${API_BASE}/auth/refresh`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ refresh_token: refreshToken })
+            });
+            if (response.ok) {
+                this.setSession(await response.json());
+                return this.getToken();
+            }
+            if (response.status === 401) {
+                // Expired or revoked: the shopper has to log in again
+                this.removeToken();
+            }
+        } catch (error) {
+            console.error('Error refreshing session:', error);
+        }
+        return null;
+    }
+    
+    static async getValidToken() {
+        // Refresh shortly before the access token expires instead of after a failed request
+        const token = this.getToken();
+        if (token && !this.tokenExpiresSoon(token)) return token;
+        return (await this.refresh()) || token;
+    }
+    
+    static async fetch(url, options = {}) {
+        // fetch() with the access token, retrying once with a refreshed token on 401
+        const send = (token) => fetch(url, {
+            ...options,
+            headers: { ...options.headers, ...(token ? { 'Authorization': `Bearer ${token}` } : {}) }
+        });
+        
+        const token = await this.getValidToken();
+        const response = await send(token);
+        if (response.status !== 401 || !this.getRefreshToken()) return response;
+        
+        const refreshed = await this.refresh();
+        return refreshed ? send(refreshed) : response;
+    }
+    
+    static logout() {
+        const refreshToken = this.getRefreshToken();
+        if (refreshToken) {
+            // Revoke server-side; keepalive lets it finish during the redirect
+            fetch(`${API_BASE}/auth/logout`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ refresh_token: refreshToken }),
+                keepalive: true
+            }).catch(() => {});
+        }
+        this.removeToken();
     }
     
     static async getCurrentUser() {
@@ -50,16 +145,12 @@ class Auth {
 
 // Image management utilities
 class ImageManager {
-    static async checkPersonalizedImage(productId) {
+    static async checkPersonalizedImage(productId, signal = undefined) {
         if (!Auth.isLoggedIn()) return null;
         
         try {
             console.log(`Checking personalized image for product ${productId}`);
-            const response = await fetch(`${API_BASE}/products/${productId}/personalized-image`, {
-                headers: {
-                    'Authorization': `Bearer ${Auth.getToken()}`
-                }
-            });
+            const response = await Auth.fetch(`${API_BASE}/products/${productId}/personalized-image`, { signal });
             
             if (response.ok) {
                 const result = await response.json();
@@ -69,19 +160,21 @@ class ImageManager {
                 console.log(`Failed to check personalized image for product ${productId}:`, response.status, response.statusText);
             }
         } catch (error) {
-            console.error('Error checking personalized image:', error);
+            if (error.name !== 'AbortError') {
+                console.error('Error checking personalized image:', error);
+            }
         }
         return null;
     }
     
-    static async triggerImageGeneration(productId) {
+    static async triggerImageGeneration(productId, signal = undefined, priority = 'browse') {
         if (!Auth.isLoggedIn()) return null;
         
         try {
-            const response = await fetch(`${API_BASE}/products/${productId}/generate-personalized-image`, {
+            const response = await Auth.fetch(`${API_BASE}/products/${productId}/generate-personalized-image?priority=${priority}`, {
                 method: 'POST',
+                signal,
                 headers: {
-                    'Authorization': `Bearer ${Auth.getToken()}`,
                     'Content-Type': 'application/json'
                 }
             });
@@ -90,7 +183,9 @@ class ImageManager {
                 return await response.json();
             }
         } catch (error) {
-            console.error('Error triggering image generation:', error);
+            if (error.name !== 'AbortError') {
+                console.error('Error triggering image generation:', error);
+            }
         }
         return null;
     }
@@ -121,7 +216,9 @@ class ImageManager {
         return newElement;
     }
     
-    static async setupPersonalizedImage(productId, productImageElement) {
+    // Resolves to the seconds to wait before asking again when the server deferred generation;
+    // the caller decides when (and whether) to retry
+    static async setupPersonalizedImage(productId, productImageElement, signal = undefined, priority = 'browse') {
         console.log(`Setting up personalized image for product ${productId}`);
         
         // Store the original URL before any changes
@@ -129,10 +226,10 @@ class ImageManager {
             productImageElement.dataset.originalUrl = productImageElement.src;
         }
         
-        const imageInfo = await this.checkPersonalizedImage(productId);
+        const imageInfo = await this.checkPersonalizedImage(productId, signal);
         console.log(`Initial image info for product ${productId}:`, imageInfo);
         
-        if (!imageInfo) {
+        if (!imageInfo || (signal && signal.aborted)) {
             console.log(`No image info available for product ${productId}`);
             return;
         }
@@ -159,12 +256,12 @@ class ImageManager {
             if (productImageElement.dataset.isPersonalized !== 'true') {
                 this.addGeneratingIndicator(productImageElement);
             }
-            this.pollForPersonalizedImage(productId, productImageElement, originalUrl);
+            this.pollForPersonalizedImage(productId, productImageElement, originalUrl, signal);
         } else if (imageInfo.ready_for_personalization) {
             // No personalized image exists - trigger generation
             console.log(`Triggering personalized image generation for product ${productId}`);
             
-            const generationResult = await this.triggerImageGeneration(productId);
+            const generationResult = await this.triggerImageGeneration(productId, signal, priority);
             console.log(`Generation trigger result for product ${productId}:`, generationResult);
             
             if (generationResult && generationResult.status === 'generation_started') {
@@ -173,7 +270,11 @@ class ImageManager {
                 if (productImageElement.dataset.isPersonalized !== 'true') {
                     this.addGeneratingIndicator(productImageElement);
                 }
-                this.pollForPersonalizedImage(productId, productImageElement, originalUrl);
+                this.pollForPersonalizedImage(productId, productImageElement, originalUrl, signal);
+            } else if (generationResult && generationResult.status === 'deferred') {
+                // The server is shedding load: ask again once its queue has had time to drain
+                console.log(`Generation deferred for product ${productId}, retry in ${generationResult.retry_after}s`);
+                return generationResult.retry_after;
             } else if (generationResult && generationResult.status === 'already_exists') {
                 // Image was generated between checks
                 console.log(`Image already exists for product ${productId}: ${generationResult.personalized_image_url}`);
@@ -247,16 +348,20 @@ class ImageManager {
         indicators.forEach(indicator => indicator.remove());
     }
     
-    static async pollForPersonalizedImage(productId, imageElement, originalUrl) {
+    static async pollForPersonalizedImage(productId, imageElement, originalUrl, signal = undefined) {
         const maxAttempts = 30; // Poll for up to 1 minute
         let attempts = 0;
         
         const poll = async () => {
+            // Cancelled (navigated away or the grid was re-rendered)
+            if (signal && signal.aborted) return;
+            
             attempts++;
             console.log(`Polling attempt ${attempts} for product ${productId}`);
             
-            const imageInfo = await this.checkPersonalizedImage(productId);
+            const imageInfo = await this.checkPersonalizedImage(productId, signal);
             console.log(`Poll result for product ${productId}:`, imageInfo);
+            if (signal && signal.aborted) return;
             
             if (imageInfo && imageInfo.has_personalized_image) {
                 // Image is ready!
@@ -298,6 +403,116 @@ class ImageManager {
     }
 }
 
+// Runs personalization only for product cards that scroll into view, a few at a time
+class PersonalizationScheduler {
+    constructor({ maxInFlight = 4, rootMargin = '200px' } = {}) {
+        this.maxInFlight = maxInFlight;
+        this.inFlight = 0;
+        this.queue = [];             // Visible cards waiting for a slot, in the order they appeared
+        this.tasks = new Map();      // element -> { productId, controller, state }
+        this.observer = 'IntersectionObserver' in window
+            ? new IntersectionObserver(entries => this.onIntersection(entries), { rootMargin })
+            : null;
+        
+        // Leaving the page cancels queued work and in-flight requests
+        window.addEventListener('pagehide', () => this.cancelAll());
+    }
+    
+    observe(productId, element) {
+        this.tasks.set(element, { productId, controller: new AbortController(), state: 'waiting' });
+        if (this.observer) {
+            this.observer.observe(element);
+        } else {
+            this.enqueue(element); // No IntersectionObserver: behave as if every card were visible
+        }
+    }
+    
+    onIntersection(entries) {
+        entries.forEach(entry => {
+            const task = this.tasks.get(entry.target);
+            if (!task) return;
+            if (entry.isIntersecting) {
+                this.enqueue(entry.target);
+            } else if (task.state === 'queued') {
+                // Scrolled past before its turn: wait until it is visible again
+                task.state = 'waiting';
+                this.queue = this.queue.filter(element => element !== entry.target);
+            }
+        });
+        this.pump();
+    }
+    
+    enqueue(element) {
+        const task = this.tasks.get(element);
+        if (task && task.state === 'waiting') {
+            task.state = 'queued';
+            this.queue.push(element);
+            this.pump();
+        }
+    }
+    
+    pump() {
+        while (this.inFlight < this.maxInFlight && this.queue.length > 0) {
+            const element = this.queue.shift();
+            const task = this.tasks.get(element);
+            if (!task || task.state !== 'queued') continue;
+            
+            task.state = 'running';
+            if (this.observer) this.observer.unobserve(element);
+            this.inFlight++;
+            ImageManager.setupPersonalizedImage(task.productId, element, task.controller.signal)
+                .then(retryAfter => {
+                    if (retryAfter) this.retryLater(element, retryAfter);
+                })
+                .catch(error => console.error('Error setting up personalized image:', error))
+                .finally(() => {
+                    this.inFlight--;
+                    this.pump();
+                });
+        }
+    }
+    
+    retryLater(element, seconds) {
+        // A deferred card goes back through the visibility check and the in-flight cap
+        const task = this.tasks.get(element);
+        if (!task) return;
+        task.state = 'deferred';
+        setTimeout(() => {
+            if (this.tasks.get(element) !== task) return; // Cancelled meanwhile
+            task.state = 'waiting';
+            if (this.observer) {
+                this.observer.observe(element); // Reports current visibility, queueing it only if on screen
+            } else {
+                this.enqueue(element);
+            }
+        }, seconds * 1000);
+    }
+    
+    cancel(element) {
+        const task = this.tasks.get(element);
+        if (!task) return;
+        task.controller.abort();
+        if (this.observer) this.observer.unobserve(element);
+        this.tasks.delete(element);
+        this.queue = this.queue.filter(queued => queued !== element);
+    }
+    
+    cancelWithin(container) {
+        // Before a grid is re-rendered: its old cards will never be seen.
+        // Detached elements were swapped out by setupImageHover and are finished
+        Array.from(this.tasks.keys())
+            .filter(element => !element.isConnected || container.contains(element))
+            .forEach(element => this.cancel(element));
+    }
+    
+    cancelAll() {
+        Array.from(this.tasks.keys()).forEach(element => this.cancel(element));
+    }
+}
+
+// Global personalization scheduler instance
+const personalizationScheduler = new PersonalizationScheduler();
+
 // API utilities
 class API {
     static async request(endpoint, options = {}) {
@@ -310,14 +525,9 @@ class API {
             ...options
         };
         
-        // Add auth token if available
-        const token = Auth.getToken();
-        if (token) {
-            config.headers.Authorization = `Bearer ${token}`;
-        }
-        
         try {
-            const response = await fetch(url, config);
+            // Adds the auth token if logged in, refreshing it when needed
+            const response = Auth.isLoggedIn() ? await Auth.fetch(url, config) : await fetch(url, config);
             const data = await response.json();
             
             if (!response.ok) {
@@ -430,7 +640,7 @@ function updateNavigation() {
 
 // Logout function
 function logout() {
-    Auth.removeToken();
+    Auth.logout();
     updateNavigation();
     window.location.href = '/';
 }
@@ -442,6 +652,20 @@ document.addEventListener('DOMContentLoaded', function() {
 
 // Product utilities
 class ProductManager {
+    static getInitialData(key) {
+        // Pages rendered by the server embed their first view as JSON
+        const element = document.getElementById('initial-data');
+        if (!element) return null;
+        
+        try {
+            const data = JSON.parse(element.textContent);
+            return data[key] || null;
+        } catch (error) {
+            console.error('Error parsing initial data:', error);
+            return null;
+        }
+    }
+    
     static async loadProducts(gender = null, category = null) {
         try {
             let endpoint = '/products/';
@@ -472,6 +696,28 @@ class ProductManager {
         }
     }
     
+    static async getRelatedProducts(id, limit = 8) {
+        try {
+            return await API.get(`/products/${id}/related?limit=${limit}`);
+        } catch (error) {
+            // Related items are optional; the page works without them
+            console.error('Error loading related products:', error);
+            return [];
+        }
+    }
+    
+    static imageAttributes(product, eager = false) {
+        // Known dimensions reserve the image's space; the placeholder shows until it has loaded
+        const attributes = [eager ? 'fetchpriority="high"' : 'loading="lazy"', 'decoding="async"'];
+        if (product.image_width && product.image_height) {
+            attributes.push(`width="${product.image_width}" height="${product.image_height}"`);
+        }
+        if (product.image_placeholder) {
+            attributes.push(`style="background-image: url('${product.image_placeholder}'); background-size: cover;"`);
+        }
+        return attributes.join(' ');
+    }
+    
     static renderProductCard(product) {
         const cardId = `product-card-${product.id}`;
         return `
@@ -480,6 +726,7 @@ class ProductManager {
                      alt="${product.name}" 
                      class="product-image" 
                      id="product-image-${product.id}"
+                     ${this.imageAttributes(product)}
                      onerror="this.src='/static/images/placeholder.jpg'">
                 <div class="product-info">
                     <div class="product-category">${product.category}</div>
@@ -494,6 +741,7 @@ class ProductManager {
         const container = document.getElementById(containerId);
         if (!container) return;
         
+        personalizationScheduler.cancelWithin(container);
         if (products.length === 0) {
             container.innerHTML = '<p style="text-align: center; color: #666;">No products found.</p>';
             return;
@@ -502,12 +750,12 @@ class ProductManager {
         const productHTML = products.map(product => this.renderProductCard(product)).join('');
         container.innerHTML = productHTML;
         
-        // Setup personalized images for logged-in users
+        // Personalize images for logged-in users as their cards scroll into view
         if (Auth.isLoggedIn()) {
             products.forEach(product => {
                 const imageElement = document.getElementById(`product-image-${product.id}`);
                 if (imageElement) {
-                    ImageManager.setupPersonalizedImage(product.id, imageElement);
+                    personalizationScheduler.observe(product.id, imageElement);
                 }
             });
         }